@@ -0,0 +1,113 @@
+# Desc: A persistent cache of closest palette matches, shared between runs and processes.
+
+from typing import List, Optional
+import os, json, time, sqlite3, threading
+
+class MatchCache:
+    """ A persistent cache of closest palette matches, keyed by palette hash, stored in an SQLite database, so that repeated runs can reuse the results of previous ones. The database may be shared by several processes at once. Writes are buffered, so call flush or close when done. The fingerprint identifies the current matching, and the cache is rebuilt when it differs from the one it was populated with. The matcher is called as matcher(colors, metric=metric) and returns an object whose find method gives the closest match of each of a list of colors, e.g. a PaletteMatcher. """
+
+    def __init__(self, path:str, fingerprint:str, matcher, max_entries:int=1_000_000):
+        self.max_entries = max_entries
+        self.matcher = matcher
+        self.lock = threading.Lock()
+        self.pending_palettes = {}; self.pending_matches = {}; self.touched = set()
+
+        self.db = sqlite3.connect(os.path.abspath(os.path.expanduser(path)), timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+        with self.db:
+            self.db.execute("DROP TABLE IF EXISTS lab") # Unused since matching is vectorized.
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS palette (palette TEXT PRIMARY KEY, metric TEXT, colors TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS match (palette TEXT, hex TEXT, match TEXT, used REAL, PRIMARY KEY (palette, hex))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS match_used ON match (used)")
+
+            # Rebuild the cache if matching has changed since it was populated, e.g. by a dependency update.
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+
+            if row is None or row[0] != fingerprint:
+                self.db.execute("DELETE FROM palette")
+                self.db.execute("DELETE FROM match")
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def put_palette(self, key:str, metric:str, colors:List[str]) -> None:
+        """ Records the palette of the given hash, so that its matches can be verified later. """
+
+        with self.lock:
+            self.pending_palettes[key] = (metric, json.dumps(colors))
+
+    def get_match(self, key:str, color:str) -> Optional[str]:
+        """ Returns the cached closest match of a color within the palette of the given hash, if any. See palette_hash. """
+
+        with self.lock:
+            match = self.pending_matches.get((key, color))
+            if match is not None: return match
+
+            row = self.db.execute("SELECT match FROM match WHERE palette = ? AND hex = ?", (key, color)).fetchone()
+            if row is None: return None
+
+            self.touched.add((key, color))
+
+        self.flush_if_needed()
+        return row[0]
+
+    def put_match(self, key:str, color:str, match:str) -> None:
+        with self.lock:
+            self.pending_matches[(key, color)] = match
+
+        self.flush_if_needed()
+
+    def flush_if_needed(self) -> None:
+        with self.lock:
+            full = len(self.pending_matches) + len(self.touched) >= 1000
+
+        if full: self.flush()
+
+    def flush(self) -> None:
+        """ Writes buffered results to the database, and evicts the least recently used matches beyond the size limit. """
+
+        with self.lock, self.db:
+            now = time.time()
+
+            self.db.executemany("INSERT OR REPLACE INTO palette VALUES (?, ?, ?)",
+                [(key, metric, colors) for key, (metric, colors) in self.pending_palettes.items()])
+            self.db.executemany("INSERT OR REPLACE INTO match VALUES (?, ?, ?, ?)",
+                [(key, color, match, now) for (key, color), match in self.pending_matches.items()])
+            self.db.executemany("UPDATE match SET used = ? WHERE palette = ? AND hex = ?",
+                [(now, key, color) for key, color in self.touched])
+
+            self.pending_palettes.clear(); self.pending_matches.clear(); self.touched.clear()
+
+            excess = self.db.execute("SELECT COUNT(*) FROM match").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.execute("DELETE FROM match WHERE rowid IN (SELECT rowid FROM match ORDER BY used LIMIT ?)", (excess,))
+
+    def verify(self) -> int:
+        """ Recomputes every cached match, corrects any that differ, and drops the matches of unknown palettes. Returns the number of corrected matches. """
+
+        self.flush()
+        corrected = 0
+
+        with self.lock, self.db:
+            palettes = {key: (metric, json.loads(colors)) for key, metric, colors in self.db.execute("SELECT palette, metric, colors FROM palette")}
+
+            for key in {row[0] for row in self.db.execute("SELECT DISTINCT palette FROM match")}:
+                if key not in palettes:
+                    corrected += self.db.execute("DELETE FROM match WHERE palette = ?", (key,)).rowcount
+                    continue
+
+                metric, colors = palettes[key]
+                rows = self.db.execute("SELECT hex, match FROM match WHERE palette = ?", (key,)).fetchall()
+                found = self.matcher(colors, metric=metric).find([color for color, _ in rows])
+
+                for (color, match), new_match in zip(rows, found):
+                    if match != new_match:
+                        self.db.execute("UPDATE match SET match = ? WHERE palette = ? AND hex = ?", (new_match, key, color))
+                        corrected += 1
+
+        return corrected
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
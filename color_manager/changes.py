@@ -0,0 +1,116 @@
+# Desc: Detection of changes within a folder, through inotify where available, and polling otherwise.
+
+from typing import Dict, Tuple
+import os, stat, time, select, struct, ctypes, ctypes.util
+
+def scan_folder(src_path:str) -> Dict[str,Tuple[int,int]]:
+    """ Returns the modification time and size of every entry within a folder and its subfolders, keyed by relative path. Symbolic links are not followed. """
+
+    index = {}
+    folders = [src_path]
+
+    while folders:
+        folder = folders.pop()
+
+        # Entries may vanish while being scanned, and are then left out, as if already deleted.
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        info = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+
+                    index[os.path.relpath(entry.path, src_path)] = (info.st_mtime_ns, info.st_size)
+
+                    if stat.S_ISDIR(info.st_mode):
+                        folders.append(entry.path)
+        except (FileNotFoundError, NotADirectoryError):
+            if folder == src_path: raise
+
+    return index
+
+def poll_changes(src_path:str, interval:float=0.5):
+    """ Yields sets of relative paths within a folder that were created, modified or deleted, by periodically comparing the folder against its previous state. """
+
+    index = scan_folder(src_path)
+
+    while True:
+        time.sleep(interval)
+        new_index = scan_folder(src_path)
+
+        changed = {path for path in new_index if index.get(path) != new_index[path]}
+        changed |= index.keys() - new_index.keys()
+        index = new_index
+
+        if changed: yield changed
+
+def inotify_changes(src_path:str, interval:float=0.5):
+    """ Yields sets of relative paths within a folder that were created, modified or deleted, as reported by the Linux inotify interface. Raises OSError if inotify is unavailable. """
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0: raise OSError(ctypes.get_errno(), "inotify is unavailable")
+
+    # Events: modify, attrib, close_write, moved_from, moved_to, create, delete.
+    mask = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+    is_dir = 0x40000000; ignored = 0x8000; overflow = 0x4000
+    folders = {}
+
+    def add_watch(rel):
+        """ Watches a folder and its subfolders. Returns every entry within. """
+        found = set()
+        for root, dirs, files in os.walk(os.path.join(src_path, rel)):
+            root_rel = os.path.normpath(os.path.relpath(root, src_path))
+            wd = libc.inotify_add_watch(fd, root.encode(), mask)
+            if wd >= 0: folders[wd] = "" if root_rel == "." else root_rel
+            found.update(os.path.join(root_rel, item) for item in dirs + files)
+        return found
+
+    try:
+        add_watch("")
+
+        while True:
+            if not select.select([fd], [], [], interval)[0]:
+                continue
+
+            changed = set()
+
+            # Collect the burst of events an editor's save usually causes.
+            while select.select([fd], [], [], 0.02)[0]:
+                buffer = os.read(fd, 1 << 16)
+                pos = 0
+
+                while pos < len(buffer):
+                    wd, event, _, size = struct.unpack_from("iIII", buffer, pos)
+                    item = buffer[pos+16:pos+16+size].rstrip(b"\0").decode("utf-8", "surrogateescape")
+                    pos += 16 + size
+
+                    if event & overflow:
+                        changed |= add_watch("")
+                        continue
+
+                    folder = folders.get(wd)
+                    if folder is None: continue
+
+                    if event & ignored:
+                        del folders[wd]
+                        continue
+
+                    rel = os.path.join(folder, item)
+                    changed.add(rel)
+
+                    if event & is_dir and event & (0x80 | 0x100):
+                        changed |= add_watch(rel)
+
+            if changed: yield changed
+    finally:
+        os.close(fd)
+
+def watch_changes(src_path:str, interval:float=0.5):
+    """ Yields sets of changed relative paths within a folder, using inotify where available, and polling otherwise. """
+
+    try:
+        yield from inotify_changes(src_path, interval)
+    except (OSError, AttributeError, TypeError):
+        yield from poll_changes(src_path, interval)
@@ -0,0 +1,37 @@
+# Desc: A command-line interface for color_manager, e.g. for build servers.
+
+import os, argparse, utils
+
+def replacement(value):
+    """Returns either a normalized hsl color given as 'h,s,l', or the given path to a palette or mapping file."""
+    try:
+        return utils.parse_hsl(value)
+    except ValueError:
+        if os.path.exists(value): return value
+        raise
+
+parser = argparse.ArgumentParser(description="Recolor icon packs, themes and wallpapers.")
+commands = parser.add_subparsers(dest="command", required=True)
+
+recolor = commands.add_parser("recolor", help="Recolor a pack.")
+recolor.add_argument("src", help="Source folder or archive.")
+recolor.add_argument("dest", help="Destination folder or archive.")
+recolor.add_argument("name", help="Name of the new pack.")
+recolor.add_argument("replacement", type=replacement, help="Palette or mapping file, or an hsl color as 'h,s,l', e.g. '180,50,50'.")
+recolor.add_argument("--cache", help="Path of a persistent match cache.")
+recolor.add_argument("--shard", help="Only recolor the i'th of N shares of the files, as 'i/N'. Finish with the merge command.")
+recolor.add_argument("--report", nargs="?", const=True, help="Summarize the duration, size and memory use of each file at the end, and optionally save the full report as json to the given path.")
+
+merge = commands.add_parser("merge", help="Assemble a pack from all shards of a sharded recolor.")
+merge.add_argument("src", help="Source folder.")
+merge.add_argument("dest", help="Destination folder.")
+merge.add_argument("name", help="Name of the new pack.")
+merge.add_argument("shards", type=int, help="Number of shards.")
+
+args = parser.parse_args()
+
+if args.command == "recolor":
+    utils.recolor(args.src, args.dest, args.name, args.replacement, cache=args.cache, shard=args.shard, report=args.report)
+
+elif args.command == "merge":
+    utils.merge_shards(args.src, args.dest, args.name, args.shards)
@@ -0,0 +1,160 @@
+# Desc: Reading and writing of GResource bundles, e.g. gtk.gresource, without glib.
+
+from typing import List, Tuple, Dict, Optional
+import zlib, struct
+
+# GResource bundles are GVDB files: a header, then a hash table of items, where each item has a key relative to its parent item, and a value. Files are stored as variants of type (uuay), i.e. their size, flags and contents, and folders as lists of their children.
+
+def parse_gvdb(data:bytes) -> Tuple[str,Dict]:
+    """ Returns the byte order of the given GVDB file, as a struct prefix, and its root hash table, with its items as dictionaries. Raises a ValueError for anything but a valid file. """
+
+    if data[:8] == b"GVariant": endian = "<"
+    elif data[:8] == b"raVGtnai": endian = ">"
+    else: raise ValueError("Not a gresource file.")
+
+    if len(data) < 24:
+        raise ValueError("Corrupt gresource file.")
+
+    version, options, start, end = struct.unpack_from(endian + "4I", data, 8)
+    if not 24 <= start <= start + 8 <= end <= len(data):
+        raise ValueError("Corrupt gresource file.")
+
+    bloom_header, n_buckets = struct.unpack_from(endian + "2I", data, start)
+    n_bloom = bloom_header & ((1 << 27) - 1)
+    gvdb_item = gvdb_items[endian]
+
+    bloom_start = start + 8
+    buckets_start = bloom_start + 4 * n_bloom
+    items_start = buckets_start + 4 * n_buckets
+
+    if items_start > end or (end - items_start) % gvdb_item.size:
+        raise ValueError("Corrupt gresource file.")
+
+    items = []
+    for offset in range(items_start, end, gvdb_item.size):
+        hash, parent, key_start, key_size, type, _, value_start, value_end = gvdb_item.unpack_from(data, offset)
+
+        if not (key_start + key_size <= len(data) and value_start <= value_end <= len(data)):
+            raise ValueError("Corrupt gresource file.")
+
+        item = {"hash": hash, "parent": parent, "key": data[key_start:key_start+key_size], "type": type}
+
+        if type == b"v":
+            item["value"] = data[value_start:value_end]
+        elif type == b"L":
+            item["value"] = list(struct.unpack_from(endian + "%dI" % ((value_end - value_start) // 4), data, value_start))
+        else:
+            raise ValueError("Unsupported gresource item type: " + repr(type))
+
+        items.append(item)
+
+    table = {
+        "version": version, "options": options, "bloom_header": bloom_header,
+        "bloom": data[bloom_start:buckets_start], "buckets": data[buckets_start:items_start], "items": items
+    }
+
+    return endian, table
+
+def build_gvdb(endian:str, table:Dict) -> bytes:
+    """ Returns the GVDB file of the given byte order and root hash table, as returned by parse_gvdb. The hash table keeps its layout, while keys and values are laid out anew after it. """
+
+    items = table["items"]
+    gvdb_item = gvdb_items[endian]
+    items_start = 24 + 8 + len(table["bloom"]) + len(table["buckets"])
+    end = items_start + gvdb_item.size * len(items)
+
+    output = bytearray(end)
+    output[0:8] = b"GVariant" if endian == "<" else b"raVGtnai"
+    struct.pack_into(endian + "4I", output, 8, table["version"], table["options"], 24, end)
+    struct.pack_into(endian + "2I", output, 24, table["bloom_header"], len(table["buckets"]) // 4)
+    output[32:items_start] = table["bloom"] + table["buckets"]
+
+    def append(chunk:bytes, alignment:int) -> Tuple[int,int]:
+        output.extend(bytes(-len(output) % alignment))
+        start = len(output)
+        output.extend(chunk)
+        return start, len(output)
+
+    for i, item in enumerate(items):
+        key_start, _ = append(item["key"], 1)
+
+        if item["type"] == b"v":
+            value_start, value_end = append(item["value"], 8)
+        else:
+            value_start, value_end = append(struct.pack(endian + "%dI" % len(item["value"]), *item["value"]), 4)
+
+        gvdb_item.pack_into(output, items_start + i * gvdb_item.size,
+            item["hash"], item["parent"], key_start, len(item["key"]), item["type"], b"\0", value_start, value_end)
+
+    return bytes(output)
+
+def get_gvdb_key(items:List[Dict], i:int) -> str:
+    """ Returns the full key of the i'th item, by prepending the keys of its parents. """
+
+    key = b""
+    for _ in range(len(items)):
+        if i >= len(items): break
+
+        key = items[i]["key"] + key
+        i = items[i]["parent"]
+        if i == 0xffffffff: return key.decode("utf-8", "surrogateescape")
+
+    raise ValueError("Corrupt gresource file.")
+
+def get_resource(value:bytes, endian:str) -> Tuple[bytes,int]:
+    """ Returns the contents and flags of a file stored in a gresource, given its variant. """
+
+    child, _, signature = value.rpartition(b"\0")
+    if signature != b"(uuay)" or len(child) < 8:
+        raise ValueError("Unsupported gresource value: " + repr(signature))
+
+    size, flags = struct.unpack_from(endian + "2I", child)
+
+    if flags & gresource_compressed:
+        try:
+            return zlib.decompress(child[8:]), flags
+        except zlib.error:
+            raise ValueError("Corrupt gresource file.")
+
+    return child[8:8+size], flags
+
+def make_resource(data:bytes, flags:int, endian:str) -> bytes:
+    """ Returns the variant of a file to be stored in a gresource. Uncompressed contents are followed by a nul byte, as glib-compile-resources does. """
+
+    if flags & gresource_compressed: payload = zlib.compress(data)
+    else: payload = data + b"\0"
+
+    return struct.pack(endian + "2I", len(data), flags) + payload + b"\0(uuay)"
+
+def iter_gresource(data:bytes):
+    """ Yields the path and contents of every file within the given gresource bundle. """
+
+    endian, table = parse_gvdb(data)
+    items = table["items"]
+
+    for i, item in enumerate(items):
+        if item["type"] == b"v":
+            yield get_gvdb_key(items, i), get_resource(item["value"], endian)[0]
+
+def transform_gresource(data:bytes, transform) -> Optional[bytes]:
+    """ Passes the contents of every file within the given gresource bundle through the given transform(path, data) function, in memory, like transform_pack. Returns the new bundle, or None if no file changed. """
+
+    endian, table = parse_gvdb(data)
+    items = table["items"]
+    changed = False
+
+    for i, item in enumerate(items):
+        if item["type"] != b"v": continue
+
+        content, flags = get_resource(item["value"], endian)
+        x = transform(get_gvdb_key(items, i), content)
+
+        if x is not None and x != content:
+            item["value"] = make_resource(x, flags, endian)
+            changed = True
+
+    return build_gvdb(endian, table) if changed else None
+
+# Layout of an item of a GVDB hash table by byte order, and the flag of compressed files in a gresource. See parse_gvdb.
+gvdb_items = {endian: struct.Struct(endian + "IIIHccII") for endian in "<>"}
+gresource_compressed = 1
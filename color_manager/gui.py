@@ -20,19 +20,7 @@ def recolor(src_path, dest_path, name, replacement, progress_bar, status):
     paths = utils.get_paths(dest_path, [".svg", ".xml"])
     n = len(paths); i = 0
     for path in paths:
-        with open(path, 'r') as file: x = file.read()
-
-        x = utils.expand_all_hex(x)
-        colors = utils.get_file_colors(x)
-
-        if op == "color":
-            x = utils.apply_monotones_to_vec(x, colors, new_colors)
-        elif op == "palette":
-            x = utils.apply_palette_to_vec(x, colors, new_colors)
-        elif op == "mapping":
-            x = utils.apply_mapping_to_vec(x, colors, new_colors)
-
-        with open(path, 'w') as file: file.write(x)
+        utils.recolor_vec_file(path, op, new_colors)
 
         i = i + 1
         progress_bar.set_fraction(i/n)
@@ -45,20 +33,7 @@ def recolor(src_path, dest_path, name, replacement, progress_bar, status):
     paths = utils.get_paths(dest_path, [".css", "rc"])
     n = len(paths); i = 0
     for path in paths:
-        with open(path, 'r') as file: x = file.read()
-
-        x = utils.css_to_hex(x)
-        x = utils.expand_all_hex(x)
-        colors = utils.get_file_colors(x)
-
-        if op == "color":
-            x = utils.apply_monotones_to_vec(x, colors, new_colors)
-        elif op == "palette":
-            x = utils.apply_palette_to_vec(x, colors, new_colors)
-        elif op == "mapping":
-            x = utils.apply_mapping_to_vec(x, colors, new_colors)
-
-        with open(path, 'w') as file: file.write(x)
+        utils.recolor_vec_file(path, op, new_colors, css=True)
 
         i = i + 1
         progress_bar.set_fraction(i/n)
@@ -128,7 +103,7 @@ class Window(Gtk.Window):
 
         mono  = ngtk.Page(self.pages, "Monochromatic", padding)
         mono.add(ngtk.Label("Choose a hue, saturation and lightness offset that will serve as the base for your monochromatic icon pack variant."))
-        self.color_picker = ngtk.HSLColorPicker()
+        self.color_picker = ngtk.HSLColorPicker(self.on_color_set)
         mono.add(self.color_picker)
 
         multi = ngtk.Page(self.pages, "Multichromatic", padding)
@@ -150,8 +125,12 @@ class Window(Gtk.Window):
         shared = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=padding)
         shared.set_border_width(padding)
         content.add(shared)
-        self.files = ngtk.Files(padding)
+        self.files = ngtk.Files(padding, self.on_source_set)
         shared.pack_start(self.files, True, True, 1)
+        self.sample = None
+        self.preview = ngtk.Preview()
+        shared.add(self.preview)
+        self.pages.connect("switch-page", self.on_page_set)
         self.progress_bar = Gtk.ProgressBar()
         shared.add(self.progress_bar)
         gen_area = Gtk.Box(spacing=padding)
@@ -165,10 +144,33 @@ class Window(Gtk.Window):
     def on_custom_palette_set(self, btn, palette_desc):
         self.palette = utils.load_json_file(btn.get_filename())
         palette_desc.set_text(self.palette["name"] + ": " + self.palette["desc"])
+        self.preview.request(self.render_preview)
 
     def on_palette_set(self, palette_picker, palette_desc):
         self.palette = utils.load_json_file(palette_picker.choice)
         palette_desc.set_text(self.palette["name"] + ": " + self.palette["desc"])
+        self.preview.request(self.render_preview)
+
+    def on_color_set(self, color):
+        self.preview.request(self.render_preview)
+
+    def on_page_set(self, pages, page, page_num):
+        self.preview.request(lambda: self.render_preview(page_num))
+
+    def on_source_set(self, source):
+        self.sample = utils.get_preview_sample(source)
+        self.preview.request(self.render_preview)
+
+    def render_preview(self, page=None):
+        """Returns a preview of the chosen color or palette applied to a sample of the source, if both are chosen."""
+        if page is None: page = self.pages.get_current_page()
+        if self.sample is None: return None
+
+        if page == 0: replacement = tuple(self.color_picker.color)
+        elif page == 1 and self.palette is not None: replacement = self.palette
+        else: return None
+
+        return utils.preview(self.sample, replacement)
 
     def on_generate(self, btn):
 
@@ -3,7 +3,7 @@
 
 import gi
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+from gi.repository import Gtk, GdkPixbuf, GLib
 import os
 
 class Page(Gtk.Box):
@@ -22,10 +22,11 @@ class Label(Gtk.Label):
         self.set_line_wrap(True)
 
 class Files(Gtk.Box):
-    """A compound widget for handling picking a source folder, a destination folder and a name for the file about to be created."""
-    def __init__(self, spacing=10):
+    """A compound widget for handling picking a source folder, a destination folder and a name for the file about to be created. Optionally calls on_source_set with the new source folder."""
+    def __init__(self, spacing=10, on_source_set=None):
         super().__init__()
         self.source = None; self.destination = None; self.name = None
+        self.on_source_changed = on_source_set
 
         grid = Gtk.Grid()
         grid.set_column_spacing(spacing)
@@ -49,6 +50,7 @@ class Files(Gtk.Box):
 
     def on_source_set(self, btn):
         self.source = btn.get_filename()
+        if self.on_source_changed is not None: self.on_source_changed(self.source)
 
     def on_destination_set(self, btn):
         self.destination = btn.get_filename()
@@ -58,9 +60,10 @@ class Files(Gtk.Box):
         if name != "": self.name = name
 
 class HSLColorPicker(Gtk.Box):
-    """An interactive color picker widget with sliders for hue, saturation and lightness."""
-    def __init__(self):
+    """An interactive color picker widget with sliders for hue, saturation and lightness. Optionally calls on_change with the new color."""
+    def __init__(self, on_change=None):
         super().__init__()
+        self.on_change = on_change
 
         grid = Gtk.Grid()
         grid.set_column_spacing(10)
@@ -96,6 +99,7 @@ class HSLColorPicker(Gtk.Box):
         h.set_value(self.color.h * 360)
         s.set_value(self.color.s * 100)
         v.set_value(self.color.v * 100)
+        if self.on_change is not None: self.on_change(self.color)
 
     def on_hue_set(self, h, hsv):
         hsv.set_color(h.get_value() / 360, self.color.s, self.color.v)
@@ -121,3 +125,33 @@ class ComboBoxFolder(Gtk.ComboBoxText):
 
     def on_combobox_changed(self, combobox, path):
         self.choice = os.path.join(path, combobox.get_active_text())
+
+class Preview(Gtk.Image):
+    """An image widget showing a PIL image, which is refreshed at most once per delay in milliseconds, however often it is requested."""
+    def __init__(self, delay=150):
+        super().__init__()
+        self.delay = delay
+        self.render = None
+        self.pending = False
+
+    def request(self, render):
+        """Schedules a refresh, where render is a function returning the PIL image to show, or None to clear it."""
+        self.render = render
+
+        if not self.pending:
+            self.pending = True
+            GLib.timeout_add(self.delay, self.on_refresh)
+
+    def on_refresh(self):
+        self.pending = False
+        img = self.render()
+
+        if img is None:
+            self.clear()
+        else:
+            img = img.convert("RGBA")
+            data = GLib.Bytes.new(img.tobytes())
+            pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(data, GdkPixbuf.Colorspace.RGB, True, 8, img.width, img.height, img.width * 4)
+            self.set_from_pixbuf(pixbuf)
+
+        return False # Run once.
@@ -0,0 +1,572 @@
+# Desc: A differential test harness, which checks the optimized recoloring functions against reference implementations of the original ones.
+
+from basic_colormath.distance import rgb_to_lab, get_delta_e_lab
+from PIL import Image
+import numpy as np
+import os, io, re, sys, json, math, random, argparse, tempfile, utils
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Reference engine -------------------------------------------------------------
+# The original, unoptimized recoloring, working on strings and single pixels. Should not change.
+
+def ref_css_to_hex(text):
+    """Returns the given string with css rgba functions and named colors substituted for their corresponding hexadecimal codes."""
+    text = re.sub(r"rgba\((\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*([\d.]+)\)",
+        lambda m: utils.rgba_to_hex((int(m.group(1)), int(m.group(2)), int(m.group(3)), float(m.group(4)))), text)
+    text = re.sub(r"rgb\((\d+)\s*,\s*(\d+)\s*,\s*(\d+)\)",
+        lambda m: utils.rgb_to_hex((int(m.group(1)), int(m.group(2)), int(m.group(3)))), text)
+
+    for key in utils.name_to_hex_dict:
+        text = re.sub(key + r"\b", utils.name_to_hex_dict[key], text)
+
+    return text
+
+def ref_expand_all_hex(text):
+    """Expand all 3-digit hexadecimal codes in the input string to 6 digits."""
+    return re.sub(r"((?<!&)#[A-Fa-f0-9]{3})\b",
+        lambda m: ("#" + "".join([c * 2 for c in m.group(1)[1:]])), text)
+
+def ref_hex_to_css(text):
+    """Convert 8-digit hexadecimal color codes to css rgba color functions."""
+    return re.sub(r"(#[0-9a-fA-F]{8})",
+        lambda m: f"rgba({int(m.group(1)[1:3], 16)}, {int(m.group(1)[3:5], 16)}, {int(m.group(1)[5:7], 16)}, {int(m.group(1)[7:9], 16) / 255.0:.2f})", text)
+
+def ref_cie94(lab_a, lab_b):
+    """Returns the CIE94 distance between two lab colors, using the graphic arts weights and the first color as reference."""
+    delta_L = lab_a[0] - lab_b[0]
+    C1 = math.hypot(lab_a[1], lab_a[2])
+    C2 = math.hypot(lab_b[1], lab_b[2])
+    delta_C = C1 - C2
+    delta_H_sq = (lab_a[1] - lab_b[1])**2 + (lab_a[2] - lab_b[2])**2 - delta_C**2
+
+    return math.sqrt(delta_L**2 + (delta_C / (1 + 0.045 * C1))**2 + max(delta_H_sq, 0) / (1 + 0.015 * C1)**2)
+
+# Reference color difference of each metric a palette may select, one pair of colors at a time.
+ref_delta_e = {
+    "cie76": math.dist,
+    "cie94": ref_cie94,
+    "ciede2000": get_delta_e_lab
+}
+
+def ref_closest_match(color, palette, labs, metric="ciede2000"):
+    """Returns the palette entry with the smallest distance to the given color under the given metric, memoizing lab colors in the given dictionary."""
+    if color not in labs:
+        labs[color] = rgb_to_lab(utils.hex_to_rgb(color))
+
+    closest_color = None
+    min_distance = float('inf')
+
+    for entry in palette:
+        distance = ref_delta_e[metric](labs[color], palette[entry])
+        if distance < min_distance:
+            min_distance = distance
+            closest_color = entry
+
+    return closest_color
+
+def ref_monotone(color, hsl):
+    h, s, l_offset = hsl
+    graytone = utils.hex_to_gray(color)
+    if s == 0: return graytone
+
+    r, g, b = utils.hex_to_rgb(graytone)
+    l = (0.21*r + 0.72*g + 0.07*b)/255
+    l = max(0, min(l + (l_offset - 0.5) * 2, 1))
+    return utils.rgb_to_hex(utils.hsl_to_rgb((h, s, l)))
+
+def ref_apply_to_vec(text, op, new_colors, css, labs, metric):
+    """Recolors an svg/xml/css string, one color at a time."""
+    text = ref_css_to_hex(text)
+    text = ref_expand_all_hex(text)
+    colors = set(re.findall(r"#[A-Fa-f0-9]{6}", text))
+
+    for color in colors:
+        if op == "color":
+            text = re.sub(color, ref_monotone(color, new_colors), text)
+        elif op == "palette":
+            text = re.sub(color, ref_closest_match(color, new_colors, labs, metric), text)
+        elif op == "mapping" and color in new_colors:
+            text = re.sub(color, new_colors[color], text)
+
+    if css: text = ref_hex_to_css(text)
+    return text
+
+def ref_apply_to_img(img, op, new_colors, smooth, alpha, labs, metric):
+    """Recolors an image, one pixel or palette entry at a time."""
+    if alpha:
+        img = img.convert("RGBA")
+        a = img.split()[3]
+    else:
+        img = img.convert("RGB")
+
+    mode = img.mode
+
+    if op == "color":
+        h, s, l_offset = new_colors
+
+        if s == 0:
+            img = img.convert("LA" if mode == "RGBA" else "L")
+        else:
+            l_offset = (l_offset - 0.5) * 2
+            for x in range(img.width):
+                for y in range(img.height):
+                    r, g, b = img.getpixel((x, y))[:3]
+                    l = max(0, min((0.21*r + 0.72*g + 0.07*b)/255 + l_offset, 1))
+                    new_color = utils.hsl_to_rgb((h, s, l))
+                    img.putpixel((x, y), new_color + img.getpixel((x, y))[3:])
+    else:
+        if smooth: img = img.convert("P", palette=Image.ADAPTIVE, colors=256)
+        else: img = img.convert("P")
+
+        palette = img.getpalette()
+        new_palette = []
+
+        for i in range(0, len(palette), 3):
+            color = "#%02x%02x%02x" % tuple(palette[i:i+3])
+            if op == "palette": color = ref_closest_match(color, new_colors, labs, metric)
+            elif color in new_colors: color = new_colors[color]
+            new_palette.extend(utils.hex_to_rgb(color))
+
+        img.putpalette(new_palette)
+
+    if alpha:
+        r, g, b, _ = img.convert("RGBA").split()
+        return Image.merge("RGBA", (r, g, b, a))
+
+    return img.convert("RGB")
+
+def reference(resource):
+    """Returns a function recoloring a named file's contents with the reference engine, given a replacement as accepted by recolor."""
+    if isinstance(resource, str): resource = utils.load_json_file(resource)
+    labs = {}; metric = "ciede2000"
+
+    if isinstance(resource, tuple):
+        new_colors, smooth, op = resource, False, "color"
+    elif resource["type"] == "palette":
+        new_colors, smooth, op = {color: rgb_to_lab(utils.hex_to_rgb(color)) for color in resource["colors"]}, resource["smooth"], "palette"
+        metric = resource.get("metric", metric)
+    else:
+        new_colors, smooth, op = resource["map"], resource["smooth"], "mapping"
+
+    def run(name, data):
+        kind = utils.get_kind(name)
+        if kind in ("vec", "css"):
+            return ref_apply_to_vec(data.decode(), op, new_colors, kind == "css", labs, metric)
+        return ref_apply_to_img(Image.open(io.BytesIO(data)), op, new_colors, smooth, kind == "png", labs, metric)
+
+    return run
+
+# Optimized engines ------------------------------------------------------------
+# Each returns a function like reference, which returns None where it does not apply. Add new fast paths here, to check them before switching them on.
+
+def decode_result(name, data, result):
+    """Returns the result of recolor_bytes as text or as an image, where None means unchanged."""
+    kind = utils.get_kind(name)
+    if result is None: result = data
+    if kind in ("vec", "css"): return result.decode()
+    return Image.open(io.BytesIO(result)).convert("RGBA")
+
+def recolor_with(name, data, new_colors, smooth, op):
+    """Recolors a named file's contents like recolor does, except that jpgs are compared before their lossy encoding."""
+    if utils.get_kind(name) == "jpg":
+        return utils.apply_to_img(Image.open(io.BytesIO(data)), op, new_colors, smooth, alpha=False)
+    return decode_result(name, data, utils.recolor_bytes(name, data, op, new_colors, smooth))
+
+def optimized(resource):
+    """The default engine, i.e. recolor_bytes with a palette matcher, on raw bytes."""
+    new_colors, smooth, op = utils.get_input_colors(resource)
+    return lambda name, data: recolor_with(name, data, new_colors, smooth, op)
+
+def text(resource):
+    """The vector recoloring, given strings instead of bytes."""
+    new_colors, smooth, op = utils.get_input_colors(resource)
+
+    def run(name, data):
+        kind = utils.get_kind(name)
+        if kind not in ("vec", "css"): return None
+        result = utils.apply_to_vec(data.decode(), op, new_colors, css=(kind == "css"))
+        return data.decode() if result is None else result
+
+    return run
+
+def cached(resource):
+    """The default engine, where every match is read from a persistent match cache, populated by a previous run."""
+    cache = utils.open_match_cache(os.path.join(tempfile.mkdtemp(), "cache.db"))
+
+    def run(name, data):
+        new_colors, smooth, op = utils.get_input_colors(resource, cache)
+        if op != "palette": return None
+
+        recolor_with(name, data, new_colors, smooth, op); cache.flush()
+        new_colors, smooth, op = utils.get_input_colors(resource, cache)
+        return recolor_with(name, data, new_colors, smooth, op)
+
+    return run
+
+engines = {"optimized": optimized, "text": text, "cached": cached}
+
+# Inputs -----------------------------------------------------------------------
+
+def get_replacements(root):
+    """Returns every palette and mapping within the repository, the first palette under every other metric, and a few hsl colors, by label."""
+    replacements = {}
+
+    for folder in ("palettes", "mappings"):
+        for path in sorted(utils.get_paths(os.path.join(root, folder), [".json"])):
+            replacements[os.path.relpath(path, root)] = path
+
+    label, path = next((label, path) for label, path in replacements.items() if utils.load_json_file(path)["type"] == "palette")
+    palette = utils.load_json_file(path)
+
+    for metric in utils.delta_e_metrics:
+        if metric != palette.get("metric", "ciede2000"):
+            replacements[label + " (" + metric + ")"] = dict(palette, metric=metric)
+
+    replacements["hsl(190,35,65)"] = utils.norm_hsl(190, 35, 65)
+    replacements["hsl(0,0,50)"] = utils.norm_hsl(0, 0, 50)
+    replacements["hsl(30,100,90)"] = utils.norm_hsl(30, 100, 90)
+    return replacements
+
+def get_assets(root, max_side):
+    """Returns the name and contents of every recolorable file within test/graphics. Images larger than max_side are scaled down, since the reference engine is slow."""
+    assets = []
+
+    for path in sorted(utils.get_paths(os.path.join(root, "test", "graphics"), [".svg", ".xml", ".css", ".png", ".jpg", ".jpeg"])):
+        name = os.path.relpath(path, root)
+        with open(path, 'rb') as file: data = file.read()
+
+        if utils.get_kind(name) in ("png", "jpg") and max_side:
+            img = Image.open(io.BytesIO(data))
+
+            if max(img.size) > max_side:
+                img.thumbnail((max_side, max_side))
+                output = io.BytesIO()
+                img.save(output, "PNG" if utils.get_kind(name) == "png" else "JPEG")
+                data = output.getvalue()
+
+        assets.append((name, data))
+
+    return assets
+
+def fuzz_color(rng):
+    """Returns a random color, in any of the notations found in svg and css files."""
+    r, g, b, a = (rng.randrange(256) for _ in range(4))
+
+    return rng.choice([
+        "#%02x%02x%02x" % (r, g, b), "#%02X%02X%02X" % (r, g, b),
+        "#%x%x%x" % (r >> 4, g >> 4, b >> 4), "#%02x%02x%02x%02x" % (r, g, b, a),
+        "rgb(%d, %d, %d)" % (r, g, b), "rgba(%d,%d,%d,%.2f)" % (r, g, b, a / 255),
+        rng.choice(list(utils.name_to_hex_dict))
+    ])
+
+def fuzz_vec(rng, css):
+    """Returns a random svg or css document, which reuses colors and includes a few near misses, such as entities and longer words."""
+    pool = [fuzz_color(rng) for _ in range(rng.randint(1, 6))]
+    noise = ["&#123;", "#abcdefg", "redirect", "tan-gent", "#12", "url(#a1b2c3)", "\n"]
+    lines = []
+
+    for i in range(rng.randint(1, 12)):
+        color = rng.choice(pool) if rng.random() < 0.7 else fuzz_color(rng)
+
+        if css: lines.append(".c%d { color: %s; border: 1px solid %s; } /* %s */" % (i, color, rng.choice(pool), rng.choice(noise)))
+        else: lines.append('<rect id="r%d" fill="%s" stroke="%s"/><!-- %s -->' % (i, color, rng.choice(pool), rng.choice(noise)))
+
+    if css: return "\n".join(lines).encode()
+    return ('<svg xmlns="http://www.w3.org/2000/svg">\n' + "\n".join(lines) + "\n</svg>\n").encode()
+
+def fuzz_img(rng, kind):
+    """Returns a random image of blocks of color, gradients and noise, with a random alpha channel, encoded as png or jpg."""
+    width, height = rng.randint(1, 48), rng.randint(1, 48)
+    np_rng = np.random.default_rng(rng.randrange(1 << 32))
+
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    for _ in range(rng.randint(1, 5)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        pixels[y:, x:] = [rng.randrange(256) for _ in range(4)]
+
+    if rng.random() < 0.5:
+        pixels[..., :3] = np.clip(pixels[..., :3] + np.linspace(0, 64, width)[None, :, None], 0, 255)
+    if rng.random() < 0.3:
+        pixels = np.clip(pixels.astype(int) + np_rng.integers(-8, 9, pixels.shape), 0, 255).astype(np.uint8)
+
+    img = Image.fromarray(pixels, "RGBA")
+    output = io.BytesIO()
+
+    if kind == "png": img.save(output, "PNG")
+    else: img.convert("RGB").save(output, "JPEG")
+
+    return output.getvalue()
+
+def get_fuzz_assets(seed, count):
+    """Returns count random files of every kind, which depend on the seed only."""
+    assets = []
+
+    for i in range(count):
+        rng = random.Random("%d-%d" % (seed, i))
+        assets.append(("fuzz/%d-%d.svg" % (seed, i), fuzz_vec(rng, css=False)))
+        assets.append(("fuzz/%d-%d.css" % (seed, i), fuzz_vec(rng, css=True)))
+        assets.append(("fuzz/%d-%d.png" % (seed, i), fuzz_img(rng, "png")))
+        assets.append(("fuzz/%d-%d.jpg" % (seed, i), fuzz_img(rng, "jpg")))
+
+    return assets
+
+# Comparison -------------------------------------------------------------------
+
+def compare_text(ref, new):
+    """Returns None if both texts are equal, or else a description of the first difference."""
+    if ref == new: return None
+
+    ref_lines, new_lines = ref.splitlines(), new.splitlines()
+    for i, (a, b) in enumerate(zip(ref_lines, new_lines)):
+        if a != b: return {"line": i + 1, "reference": a, "optimized": b}
+
+    return {"line": min(len(ref_lines), len(new_lines)) + 1, "reference": "%d lines" % len(ref_lines), "optimized": "%d lines" % len(new_lines)}
+
+def compare_img(ref, new, tolerance):
+    """Returns the per-pixel CIEDE2000 statistics of two images of the same size, and whether they agree within the tolerance. Alpha channels must match exactly."""
+    ref = np.asarray(ref.convert("RGBA")).reshape(-1, 4)
+    new = np.asarray(new.convert("RGBA")).reshape(-1, 4)
+
+    if ref.shape != new.shape:
+        return {"ok": False, "error": "sizes differ"}
+
+    # Only differing pixels, and each differing pair of colors once.
+    differ = np.flatnonzero((ref[:, :3] != new[:, :3]).any(axis=1))
+    pairs, inverse = np.unique(np.hstack((ref[differ, :3], new[differ, :3])), axis=0, return_inverse=True)
+    distances = np.array([get_delta_e_lab(rgb_to_lab(pair[:3]), rgb_to_lab(pair[3:])) for pair in pairs.tolist()])
+
+    delta_e = np.zeros(len(ref))
+    if len(differ): delta_e[differ] = distances[inverse.reshape(-1)]
+    worst = int(np.argmax(delta_e))
+
+    stats = {
+        "pixels": len(ref), "differing": len(differ),
+        "alpha_differing": int((ref[:, 3] != new[:, 3]).sum()),
+        "mean_delta_e": float(delta_e.mean()) if len(ref) else 0.0,
+        "p99_delta_e": float(np.percentile(delta_e, 99)) if len(ref) else 0.0,
+        "max_delta_e": float(delta_e.max()) if len(ref) else 0.0,
+        "worst": {"index": worst, "reference": "#%02x%02x%02x" % tuple(ref[worst, :3]), "optimized": "#%02x%02x%02x" % tuple(new[worst, :3])} if len(differ) else None
+    }
+
+    stats["ok"] = stats["alpha_differing"] == 0 and stats["max_delta_e"] <= tolerance
+    return stats
+
+def compare(name, ref, new, tolerance):
+    """Returns whether two results agree, and a description of how."""
+    if isinstance(ref, str):
+        difference = compare_text(ref, new)
+        return difference is None, difference
+
+    stats = compare_img(ref, new, tolerance)
+    return stats["ok"], stats
+
+# Minimization -----------------------------------------------------------------
+
+def minimize_text(text, fails, max_tries=2000):
+    """Returns a smallest found subset of the lines of the text for which fails still holds, by removing ever smaller chunks of lines."""
+    lines = text.splitlines(keepends=True)
+    chunk = max(len(lines) // 2, 1); tries = 0
+
+    while chunk >= 1 and tries < max_tries:
+        i = 0; removed = False
+
+        while i < len(lines) and tries < max_tries:
+            candidate = lines[:i] + lines[i+chunk:]
+            tries += 1
+
+            if candidate and fails("".join(candidate)):
+                lines = candidate; removed = True
+            else:
+                i += chunk
+
+        if not removed: chunk //= 2
+
+    return "".join(lines)
+
+def minimize_img(img, fails, max_tries=200):
+    """Returns a smallest found crop of the image for which fails still holds, by repeatedly halving it, and the crop's box."""
+    box = (0, 0) + img.size; tries = 0
+
+    while tries < max_tries:
+        left, top, right, bottom = box
+        if right - left > bottom - top:
+            middle = (left + right) // 2
+            halves = [(left, top, middle, bottom), (middle, top, right, bottom)]
+        else:
+            middle = (top + bottom) // 2
+            halves = [(left, top, right, middle), (left, middle, right, bottom)]
+
+        for half in halves:
+            tries += 1
+            if half[2] > half[0] and half[3] > half[1] and fails(img.crop(half)):
+                box = half
+                break
+        else:
+            break
+
+    return img.crop(box), box
+
+def reproduce(name, data, ref_run, new_run, tolerance):
+    """Returns a minimal input for which the engines still disagree, as text or as an encoded image, and a description of it."""
+    kind = utils.get_kind(name)
+
+    def fails(candidate):
+        try: return not compare(name, ref_run(name, candidate), new_run(name, candidate), tolerance)[0]
+        except Exception: return True
+
+    if kind in ("vec", "css"):
+        text = minimize_text(data.decode(), lambda text: fails(text.encode()))
+        return text.encode(), {"lines": len(text.splitlines())}
+
+    def encode(img):
+        output = io.BytesIO()
+        img.save(output, "PNG" if kind == "png" else "JPEG")
+        return output.getvalue()
+
+    src = Image.open(io.BytesIO(data))
+    crop, box = minimize_img(src, lambda img: fails(encode(img)))
+    return encode(crop), {"box": box}
+
+# Kernels ----------------------------------------------------------------------
+
+def get_probe_colors(seed, count):
+    """Returns count random rgb colors, which depend on the seed only, after the corners and the diagonal of the rgb cube."""
+    rng = random.Random(seed)
+    colors = [(r, g, b) for r in (0, 255) for g in (0, 255) for b in (0, 255)]
+    colors += [(v, v, v) for v in range(0, 256, 17)]
+    colors += [tuple(rng.randrange(256) for _ in range(3)) for _ in range(count)]
+    return colors
+
+def check_kernels(root=root_path, seed=0, count=2000, tolerance=1e-6):
+    """Compares the vectorized lab conversion and color difference kernels against basic_colormath, or a scalar implementation where it has none, for random colors against every palette. Returns the largest errors, and every color whose closest palette entry differs, unless both entries are equally close."""
+
+    colors = get_probe_colors(seed, count)
+    ref_labs = [rgb_to_lab(color) for color in colors]
+    labs = utils.rgb_to_lab_array(np.array(colors))
+
+    report = {"lab_max_error": float(np.abs(labs - np.array(ref_labs)).max()), "metrics": {}}
+    report["ok"] = report["lab_max_error"] <= tolerance
+
+    palettes = {
+        os.path.relpath(path, root): utils.load_json_file(path)["colors"]
+        for path in sorted(utils.get_paths(os.path.join(root, "palettes"), [".json"]))
+    }
+
+    for metric, delta_e in utils.delta_e_metrics.items():
+        entry = report["metrics"][metric] = {"max_error": 0.0, "argmin_mismatches": []}
+
+        for label, palette in palettes.items():
+            palette_labs = [rgb_to_lab(utils.hex_to_rgb(color)) for color in palette]
+
+            distances = delta_e(labs, utils.hex_to_lab_array(palette))
+            ref_distances = np.array([[ref_delta_e[metric](a, b) for b in palette_labs] for a in ref_labs])
+            entry["max_error"] = max(entry["max_error"], float(np.abs(distances - ref_distances).max()))
+
+            found = np.argmin(distances, axis=1); ref_found = np.argmin(ref_distances, axis=1)
+
+            for i in np.flatnonzero(found != ref_found):
+                ref_row = ref_distances[i]
+                if abs(ref_row[found[i]] - ref_row[ref_found[i]]) <= tolerance: continue
+
+                entry["argmin_mismatches"].append({
+                    "palette": label, "color": utils.rgb_to_hex(colors[i]),
+                    "reference": palette[ref_found[i]], "optimized": palette[found[i]]
+                })
+
+        report["ok"] &= entry["max_error"] <= tolerance and not entry["argmin_mismatches"]
+
+    return report
+
+# Running ----------------------------------------------------------------------
+
+def run(root=root_path, names=None, fuzz=25, seed=0, max_side=256, tolerance=0.0, repro_path=None, verbose=True):
+    """Runs the reference engine and the named optimized engines, all by default, over every file in test/graphics and generated fuzz inputs, with every palette, mapping and a few hsl colors. Returns a report of every comparison, and saves minimal reproductions of mismatches to repro_path, if given. Raster results may differ by at most the tolerance, as a CIEDE2000 distance, while text must match exactly. The color difference kernels are checked first, see check_kernels."""
+
+    names = list(engines) if names is None else names
+    replacements = get_replacements(root)
+    assets = get_assets(root, max_side) + get_fuzz_assets(seed, fuzz)
+
+    report = {"seed": seed, "tolerance": tolerance, "kernels": check_kernels(root, seed), "engines": {name: {"compared": 0, "mismatches": []} for name in names}}
+    delta_e = {name: [] for name in names}
+
+    for label, resource in replacements.items():
+        ref_run = reference(resource)
+        new_runs = {name: engines[name](resource) for name in names}
+
+        for name, data in assets:
+            ref = ref_run(name, data)
+
+            for engine, new_run in new_runs.items():
+                try:
+                    new = new_run(name, data)
+                    if new is None: continue
+                    ok, detail = compare(name, ref, new, tolerance)
+                except Exception as error:
+                    ok, detail = False, {"error": repr(error)}
+
+                entry = report["engines"][engine]
+                entry["compared"] += 1
+
+                if isinstance(detail, dict) and "max_delta_e" in detail:
+                    delta_e[engine].append(detail["max_delta_e"])
+
+                if ok: continue
+
+                mismatch = {"file": name, "replacement": label, "detail": detail}
+                if verbose: print("Mismatch:", engine, label, name, detail, file=sys.stderr)
+
+                if repro_path is not None:
+                    repro, description = reproduce(name, data, ref_run, new_run, tolerance)
+                    path = os.path.join(repro_path, engine, re.sub(r"[^\w.-]", "_", label), name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as file: file.write(repro)
+                    mismatch["repro"] = dict(description, path=path)
+
+                entry["mismatches"].append(mismatch)
+
+    for engine, values in delta_e.items():
+        report["engines"][engine]["max_delta_e"] = max(values, default=0.0)
+
+    return report
+
+def summarize(report):
+    """Returns a human-readable summary of a report from run."""
+    kernels = report["kernels"]
+    lines = ["%-10s max lab error %.2e" % ("kernels", kernels["lab_max_error"])]
+
+    for metric, entry in kernels["metrics"].items():
+        lines.append("    %-9s max error %.2e, %d closest matches differ" % (metric, entry["max_error"], len(entry["argmin_mismatches"])))
+
+        for mismatch in entry["argmin_mismatches"][:10]:
+            lines.append("        %s in %s: %s instead of %s" % (mismatch["color"], mismatch["palette"], mismatch["optimized"], mismatch["reference"]))
+
+    for engine, entry in report["engines"].items():
+        lines.append("%-10s %5d compared, %4d mismatched, max raster delta-E %.3f" % (engine, entry["compared"], len(entry["mismatches"]), entry["max_delta_e"]))
+
+        for mismatch in entry["mismatches"][:10]:
+            lines.append("    %s with %s: %s" % (mismatch["file"], mismatch["replacement"], mismatch.get("repro", mismatch["detail"])))
+
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check optimized recoloring against the reference implementation.")
+    parser.add_argument("engines", nargs="*", help="Engines to check, all by default: " + ", ".join(engines) + ".")
+    parser.add_argument("--fuzz", type=int, default=25, help="Number of generated files of each kind.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-side", type=int, default=256, help="Scale larger images down to this size, or 0 for none.")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="Largest allowed CIEDE2000 distance between raster pixels.")
+    parser.add_argument("--repro", help="Save minimal reproductions of mismatches to this folder.")
+    parser.add_argument("--json", help="Save the full report to this file.")
+    args = parser.parse_args()
+
+    for name in args.engines:
+        if name not in engines: parser.error("unknown engine: " + name)
+
+    report = run(root_path, args.engines or None, args.fuzz, args.seed, args.max_side, args.tolerance, args.repro)
+
+    if args.json is not None:
+        with open(args.json, 'w') as file: json.dump(report, file, indent=2)
+
+    print(summarize(report))
+    sys.exit(not report["kernels"]["ok"] or any(entry["mismatches"] for entry in report["engines"].values()))
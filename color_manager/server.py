@@ -0,0 +1,186 @@
+# Desc: A local server for recoloring single assets on demand, e.g. for previews.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+import os, json, hashlib, argparse, threading, utils
+
+content_types = {
+    "vec": "image/svg+xml",
+    "css": "text/css",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "gresource": "application/octet-stream"
+}
+
+class LRUCache:
+    """A thread-safe cache of recolored assets, bounded by the total size of the cached assets in bytes."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0; self.hits = 0; self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes: return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+
+            self.entries[key] = data
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+
+    def metrics(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.size, "max_bytes": self.max_bytes
+            }
+
+class Palettes:
+    """Keeps every replacement that has been requested compiled in memory, keyed by its source, and reloads palette files when they change."""
+    def __init__(self):
+        self.compiled = {}
+        self.lock = threading.Lock()
+
+    def get(self, replacement):
+        """Returns the compiled replacement and its hash, given either a path to a palette or mapping file, or an hsl color as 'h,s,l' in degrees and percent, like the command-line interface."""
+        if os.path.isfile(replacement):
+            key = utils.expand_path(replacement)
+            version = os.path.getmtime(key)
+        else:
+            try: key = utils.parse_hsl(replacement)
+            except ValueError: raise ValueError("Invalid replacement: " + replacement)
+            version = None
+
+        with self.lock:
+            # A changed file replaces its previous version.
+            entry = self.compiled.get(key)
+
+            if entry is None or entry[0] != version:
+                resource = key if version is None else utils.load_json_file(key)
+                digest = hashlib.sha256(json.dumps(resource, sort_keys=True).encode()).hexdigest()
+                entry = self.compiled[key] = version, utils.get_input_colors(resource), digest
+
+            return entry[1:]
+
+class Handler(BaseHTTPRequestHandler):
+    """Handles 'POST /recolor?name=icon.svg&replacement=palettes/nord.json' with the asset as the request body, as well as 'GET /metrics'."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == "/metrics":
+            metrics = self.server.cache.metrics()
+            metrics["palettes"] = len(self.server.palettes.compiled)
+            self.respond(200, json.dumps(metrics).encode(), "application/json")
+        else:
+            self.respond(404, b"Not found", "text/plain")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path != "/recolor":
+            self.respond(404, b"Not found", "text/plain")
+            return
+
+        try:
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            name = query["name"]
+
+            kind = utils.get_kind(name)
+            if kind is None:
+                raise ValueError("Unsupported file type: " + name)
+
+            (new_colors, smooth, op), digest = self.server.palettes.get(query["replacement"])
+
+        except (KeyError, ValueError, OSError) as error:
+            self.respond(400, str(error).encode(), "text/plain")
+            return
+
+        key = (hashlib.sha256(data).hexdigest(), digest, kind)
+        result = self.server.cache.get(key)
+
+        if result is None:
+            try:
+                result = utils.recolor_bytes(name, data, op, new_colors, smooth)
+            except (OSError, ValueError, SyntaxError) as error:
+                # Malformed assets, e.g. a body that is not the image its name claims.
+                self.respond(400, ("Invalid asset: " + str(error)).encode(), "text/plain")
+                return
+            except Exception as error:
+                self.respond(500, str(error).encode(), "text/plain")
+                return
+
+            if result is None: result = data
+            self.server.cache.put(key, result)
+
+        self.respond(200, result, content_types[kind])
+
+    def respond(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no client address.
+        return self.client_address[0] if self.client_address else "unix"
+
+class UnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+def serve(host="127.0.0.1", port=8700, socket_path=None, cache_bytes=64 << 20):
+    """Serves recolor requests until interrupted, either on a localhost port or on a unix socket."""
+
+    if socket_path is None:
+        server = ThreadingHTTPServer((host, port), Handler)
+        print("Serving on http://" + host + ":" + str(port))
+    else:
+        if os.path.exists(socket_path): os.remove(socket_path)
+        server = UnixServer(socket_path, Handler)
+        print("Serving on " + socket_path)
+
+    server.cache = LRUCache(cache_bytes)
+    server.palettes = Palettes()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None: os.remove(socket_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recolor single assets on demand.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--socket", help="Serve on this unix socket instead of a port.")
+    parser.add_argument("--cache-mb", type=int, default=64, help="Maximum size of cached assets.")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.socket, args.cache_mb << 20)
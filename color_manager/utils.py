@@ -1,12 +1,30 @@
 # Desc: A program for recoloring icon packs, themes and wallpapers. For NovaOS.
 # Auth: Nicklas Vraa
 
-from typing import Annotated, List, Set, Tuple, Dict, Optional
+from typing import Annotated, List, Set, Tuple, Dict, Optional, Union
+from collections import OrderedDict
+from contextlib import contextmanager
 from tqdm import tqdm
 # from basic_colormath.type_hints import RGB, Lab
 from basic_colormath.distance import rgb_to_lab, get_delta_e_lab
-from PIL import Image, ImageDraw
-import os, re, shutil, json, subprocess
+from PIL import Image, ImageDraw, JpegImagePlugin
+import numpy as np
+import os, io, re, sys, mmap, stat, time, queue, shutil, json, hashlib, tarfile, threading, zipfile, subprocess
+import multiprocessing, tracemalloc
+
+try:
+    import resource
+except ImportError: # Not available on Windows.
+    resource = None
+
+try:
+    from .changes import watch_changes
+    from .cache import MatchCache
+    from .gresource import transform_gresource
+except ImportError: # Run as a script rather than as a package.
+    from changes import watch_changes
+    from cache import MatchCache
+    from gresource import transform_gresource
 
 
 # Using custom type hints as the default ones in basic_colormath.type_hits arent compatible past python 3.8
@@ -147,33 +165,71 @@ def norm_hsl(h:int, s:int, l:int) -> Tuple[float,float,float]:
     """ Normalize hsl color values. """
     return h/360, s/100, l/100
 
+def parse_hsl(text:str) -> Tuple[float,float,float]:
+    """ Returns the normalized hsl color given as 'h,s,l' in degrees and percent, e.g. '180,50,50'. Raises a ValueError if it is malformed or out of range. """
+
+    h, s, l = (int(x) for x in text.split(","))
+
+    if not (0 <= h <= 360 and 0 <= s <= 100 and 0 <= l <= 100):
+        raise ValueError("Hsl color out of range: " + text)
+
+    return norm_hsl(h, s, l)
+
+# Text handling ----------------------------------------------------------------
+
+def compile_both(pattern:str) -> Tuple[re.Pattern,re.Pattern]:
+    """ Returns the given regular expression compiled for both str and bytes input. """
+    return re.compile(pattern), re.compile(pattern.encode())
+
+def pick(pair:Tuple, text):
+    """ Returns the str or bytes variant of the given pair, depending on the type of the given text. """
+    return pair[not isinstance(text, str)]
+
+def as_type(string:str, text):
+    """ Returns the given string encoded as bytes, if the given text is not a str. """
+    return string if isinstance(text, str) else string.encode()
+
+@contextmanager
+def open_vec_file(path:str):
+    """ Yields the raw contents of a text-based file as bytes. Large files are yielded as a read-only memory map instead, which the precompiled bytes patterns can search directly, without first copying the file into memory. """
+
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+
+        if size < mmap_threshold:
+            yield file.read()
+        else:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
 # Preprocessing ----------------------------------------------------------------
 
 def expand_css_rgba(match) -> str:
     """ Used by the css_to_hex function. """
-    return rgba_to_hex((
+    return as_type(rgba_to_hex((
         int(match.group(1)), int(match.group(2)),
         int(match.group(3)), float(match.group(4))
-    ))
+    )), match.string)
 
 def expand_css_rgb(match) -> str:
     """ Used by the css_to_hex function. """
-    return rgb_to_hex((
+    return as_type(rgb_to_hex((
         int(match.group(1)), int(match.group(2)),
         int(match.group(3)))
-    )
+    ), match.string)
 
 def css_to_hex(text:str) -> str:
-    """ Returns the given string with css rgba functions and named colors substituted for their corresponding hexadecimal codes. """
+    """ Returns the given string with css rgba functions and named colors substituted for their corresponding hexadecimal codes. Also accepts bytes. """
 
-    text = re.sub(r"rgba\((\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*([\d.]+)\)",
-                  expand_css_rgba, text)
+    text = pick(css_rgba_pattern, text).sub(expand_css_rgba, text)
+    text = pick(css_rgb_pattern, text).sub(expand_css_rgb, text)
 
-    text = re.sub(r"rgb\((\d+)\s*,\s*(\d+)\s*,\s*(\d+)\)",
-                  expand_css_rgb, text)
+    # Most files contain no named colors, so check for any before substituting each one.
+    if pick(any_named_color_pattern, text).search(text) is None:
+        return text
 
-    for key in name_to_hex_dict:
-        text = re.sub(key + r"\b", name_to_hex_dict[key], text)
+    for pattern, hex in named_color_patterns:
+        text = pick(pattern, text).sub(pick(hex, text), text)
 
     return text
 
@@ -183,20 +239,120 @@ def hex_to_rgba(match) -> str:
     """ Converts 8-digit hexadecimal code to rgba function. """
     hex = match.group(1)
 
-    return f"rgba({int(hex[1:3], 16)}, {int(hex[3:5], 16)}, {int(hex[5:7], 16)}, {int(hex[7:9], 16) / 255.0:.2f})"
+    return as_type(f"rgba({int(hex[1:3], 16)}, {int(hex[3:5], 16)}, {int(hex[5:7], 16)}, {int(hex[7:9], 16) / 255.0:.2f})", match.string)
 
 def hex_to_css(text:str) -> str:
-    """ Convert 8-digit hexadecimal color codes to css rgba color functions. Needed when a css interpreter does not recognize the alpha-channel when reading hexadecimal color codes. """
+    """ Convert 8-digit hexadecimal color codes to css rgba color functions. Needed when a css interpreter does not recognize the alpha-channel when reading hexadecimal color codes. Also accepts bytes. """
+
+    return pick(hex8_pattern, text).sub(hex_to_rgba, text)
 
-    return re.sub(r"(#[0-9a-fA-F]{8})", hex_to_rgba, text)
+def expand_hex(match) -> str:
+    """ Used by the expand_all_hex function. """
+    hex = match.group(1)
+    return hex[0:1] + hex[1:2]*2 + hex[2:3]*2 + hex[3:4]*2
 
 def expand_all_hex(text:str) -> str:
-    """Expand all 3-digit hexadecimal codes in the input string to 6 digits."""
+    """Expand all 3-digit hexadecimal codes in the input string to 6 digits. Also accepts bytes."""
+
+    return pick(hex3_pattern, text).sub(expand_hex, text)
+
+# Vectorized color difference --------------------------------------------------
+
+def rgb_to_lab_array(rgb:np.ndarray) -> np.ndarray:
+    """ Converts an array of rgb colors with shape (..., 3) and values from 0 to 255 into lab colors, exactly like rgb_to_lab. """
+
+    rgb = np.asarray(rgb, dtype=np.float64)
+
+    linear = np.where(rgb <= 10.31475, rgb / 3294.6, ((rgb + 14.025) / 269.025) ** 2.4)
+    xyz = np.maximum(linear @ rgb_to_xyz_matrix.T, 0) / xyz_illuminant
+    xyz = np.where(xyz > 216 / 24389, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+    return np.stack([116 * y - 16.0, 500 * (x - y), 200 * (y - z)], axis=-1)
+
+def hex_to_lab_array(colors:List[str]) -> np.ndarray:
+    """ Converts a list of 6-digit hexadecimal colors into an array of lab colors, with shape (n, 3). """
+    return rgb_to_lab_array(np.array([hex_to_rgb(color) for color in colors], dtype=np.float64).reshape(-1, 3))
+
+def delta_e_cie76(lab_a:np.ndarray, lab_b:np.ndarray) -> np.ndarray:
+    """ Returns the matrix of CIE76 distances, i.e. euclidian distances in the CIELAB colorspace, between n and m lab colors, with shape (n, m). The fastest, but least perceptually accurate metric. """
+
+    diff = lab_a[:, None, :] - lab_b[None, :, :]
+    return np.sqrt(np.einsum("nmk,nmk->nm", diff, diff))
+
+def delta_e_cie94(lab_a:np.ndarray, lab_b:np.ndarray) -> np.ndarray:
+    """ Returns the matrix of CIE94 distances between n and m lab colors, with shape (n, m), using the graphic arts weights and the first colors as reference. """
+
+    a = lab_a[:, None, :]; b = lab_b[None, :, :]
+
+    delta_L = a[..., 0] - b[..., 0]
+    C1 = np.hypot(a[..., 1], a[..., 2])
+    C2 = np.hypot(b[..., 1], b[..., 2])
+    delta_C = C1 - C2
+
+    delta_H_sq = (a[..., 1] - b[..., 1])**2 + (a[..., 2] - b[..., 2])**2 - delta_C**2
+    S_C = 1 + 0.045 * C1
+    S_H = 1 + 0.015 * C1
+
+    return np.sqrt(delta_L**2 + (delta_C / S_C)**2 + np.maximum(delta_H_sq, 0) / S_H**2)
+
+def delta_e_ciede2000(lab_a:np.ndarray, lab_b:np.ndarray) -> np.ndarray:
+    """ Returns the matrix of CIEDE2000 distances between n and m lab colors, with shape (n, m). Follows get_delta_e_lab from basic_colormath term by term, so that both agree to within floating point error. The most perceptually accurate, but slowest metric. """
 
-    return re.sub(
-        r"((?<!&)#[A-Fa-f0-9]{3})\b",
-        lambda match: ("#" + "".join([c * 2 for c in match.group(1)[1:]])),
-        text
+    a = lab_a[:, None, :]; b = lab_b[None, :, :]
+    a_bsq = a[..., 2]**2; b_bsq = b[..., 2]**2
+
+    Lp = (a[..., 0] + b[..., 0]) / 2.0
+
+    C1 = np.sqrt(a[..., 1]**2 + a_bsq)
+    C2 = np.sqrt(b[..., 1]**2 + b_bsq)
+    avg_c_e7 = ((C1 + C2) / 2.0)**7
+    G = 0.5 * (1 - np.sqrt(avg_c_e7 / (avg_c_e7 + 25.0**7))) + 1
+
+    a1p = a[..., 1] * G; a2p = b[..., 1] * G
+
+    C1p = np.sqrt(a1p**2 + a_bsq)
+    C2p = np.sqrt(a2p**2 + b_bsq)
+    Cp = (C1p + C2p) / 2.0
+
+    h1p = np.arctan2(np.broadcast_to(a[..., 2], a1p.shape), a1p)
+    h1p = np.where(h1p >= 0, h1p, h1p + 2*np.pi)
+    h2p = np.arctan2(np.broadcast_to(b[..., 2], a2p.shape), a2p)
+    h2p = np.where(h2p >= 0, h2p, h2p + 2*np.pi)
+    Hp = (h1p + h2p) / 2
+    Hp = np.where(np.abs(h1p - h2p) <= np.pi, Hp, Hp + np.pi)
+
+    T = (
+        1
+        - 0.17 * np.cos(Hp - np.radians(30))
+        + 0.24 * np.cos(2 * Hp)
+        + 0.32 * np.cos(3 * Hp + np.radians(6))
+        - 0.2 * np.cos(4 * Hp - np.radians(63))
+    )
+
+    delta_hp = h2p - h1p
+    delta_hp = np.where(np.abs(delta_hp) > np.pi, np.where(h2p > h1p, delta_hp - 2*np.pi, delta_hp + 2*np.pi), delta_hp)
+
+    delta_Lp = b[..., 0] - a[..., 0]
+    delta_Cp = C2p - C1p
+    delta_Hp = 2 * np.sqrt(C2p * C1p) * np.sin(delta_hp / 2)
+
+    lp_minus_50_sq = (Lp - 50)**2
+    S_L = 1 + (0.015 * lp_minus_50_sq) / np.sqrt(20 + lp_minus_50_sq)
+    S_C = 1 + 0.045 * Cp
+    S_H = 1 + 0.015 * Cp * T
+
+    delta_ro = np.radians(30) * np.exp(-(((Hp - np.radians(275)) / np.radians(25))**2))
+
+    avg_cp_e7 = Cp**7
+    R_C = np.sqrt(avg_cp_e7 / (avg_cp_e7 + 25.0**7))
+    R_T = -2 * R_C * np.sin(2 * delta_ro)
+
+    return np.sqrt(
+        (delta_Lp / S_L)**2
+        + (delta_Cp / S_C)**2
+        + (delta_Hp / S_H)**2
+        + R_T * delta_Cp / S_C * delta_Hp / S_H
     )
 
 # Color comparision ------------------------------------------------------------
@@ -211,8 +367,8 @@ def generate_palette_dict(colors:List[str]) -> Dict[str,Lab]:
 
     return palette_dict
 
-def get_input_colors(resource):
-    """ Returns an HSL tuple, or a palette of colors, or a color mapping, depending on the input, as well as a string indicating which one, and if smoothing should be applied to pngs/jpgs. """
+def get_input_colors(resource, cache:"MatchCache"=None):
+    """ Returns an HSL tuple, or a palette matcher, or a color mapping, depending on the input, as well as a string indicating which one, and if smoothing should be applied to pngs/jpgs. Optionally specify a persistent match cache for the palette matcher to use. """
 
     # If resource is an hsl color.
     if isinstance(resource, tuple) and len(resource) == 3:
@@ -224,38 +380,33 @@ def get_input_colors(resource):
             resource = load_json_file(resource)
 
         if resource["type"] == "palette":
-            return generate_palette_dict(resource["colors"]), resource["smooth"], "palette"
+            metric = resource.get("metric", "ciede2000")
+            return PaletteMatcher(resource["colors"], cache, metric), resource["smooth"], "palette"
 
         elif resource["type"] == "mapping":
             return resource["map"], resource["smooth"], "mapping"
 
 def get_file_colors(text:str) -> Set[str]:
-    """ Return a set of all unique colors within a given string representing an svg-file. """
+    """ Return a set of all unique colors within a given string or bytes object representing an svg-file. """
 
-    colors = set()
-    matches = re.findall(r"#[A-Fa-f0-9]{6}", text)
+    colors = set(pick(hex6_pattern, text).findall(text))
 
-    for match in matches:
-        colors.add(match)
+    if not isinstance(text, str):
+        colors = {color.decode() for color in colors}
 
     return colors
 
-def closest_match(color:str, palette:Dict[str,Lab]) -> str:
+def closest_match(color:str, palette:"Union[PaletteMatcher,Dict[str,Lab]]") -> str:
     """ Compare the similarity of colors in the CIELAB colorspace. Return the closest match, i.e. the palette entry with the smallest euclidian distance to the given color. """
 
+    if isinstance(palette, PaletteMatcher):
+        return palette.match(color)
+
     closest_color = None
     min_distance = float('inf')
+    lab_color = hex_to_lab(color)
 
     for entry in palette:
-
-        # Prior dictionary lookup and update.
-        lab_color = hex_to_lab_dict.get(color)
-
-        if lab_color is None:
-            r, g, b = hex_to_rgb(color)
-            lab_color = rgb_to_lab(sRGBColor(r,g,b))
-            hex_to_lab_dict[color] = lab_color
-
         distance = get_delta_e_lab(lab_color, palette[entry])
 
         if distance < min_distance:
@@ -264,29 +415,248 @@ def closest_match(color:str, palette:Dict[str,Lab]) -> str:
 
     return closest_color
 
+def hex_to_lab(color:str) -> Lab:
+    """ Converts 6-digit hexadecimal color to lab color, memoized in a global dictionary. """
+
+    lab_color = hex_to_lab_dict.get(color)
+    if lab_color is not None: return lab_color
+
+    r, g, b = hex_to_rgb(color)
+    lab_color = rgb_to_lab(sRGBColor(r,g,b))
+
+    # Keep the dictionary bounded in long-running processes.
+    if len(hex_to_lab_dict) >= max_lab_entries:
+        hex_to_lab_dict.clear()
+
+    hex_to_lab_dict[color] = lab_color
+    return lab_color
+
+def palette_hash(palette:Dict[str,Lab], metric:str="ciede2000") -> str:
+    """ Returns a short hash identifying the given palette by its colors and color difference metric. """
+    return hashlib.sha1((",".join(sorted(palette)) + ";" + metric).encode()).hexdigest()[:16]
+
+def as_matcher(palette:"Union[PaletteMatcher,Dict[str,Lab]]") -> "PaletteMatcher":
+    """ Returns the given palette as a palette matcher, wrapping it if it is a palette dictionary. """
+    return palette if isinstance(palette, PaletteMatcher) else PaletteMatcher(palette)
+
+class PaletteMatcher:
+    """ Finds the closest matches to colors within a color palette, like closest_match. Owns the palette's lab colors and a bounded memo of previous matches, and optionally uses a persistent match cache. The color difference metric is either 'ciede2000', 'cie94' or 'cie76'. Safe to share between threads. """
+
+    def __init__(self, palette:"Union[List[str],Dict[str,Lab]]", cache:"MatchCache"=None, metric:str="ciede2000", memo_size:int=1 << 16):
+        if not isinstance(palette, dict):
+            palette = generate_palette_dict(palette)
+
+        if metric not in delta_e_metrics:
+            raise Exception("Unknown metric: " + metric)
+
+        self.palette = palette
+        self.entries = list(palette)
+        self.labs = np.array([palette[entry] for entry in self.entries], dtype=np.float64).reshape(-1, 3)
+        self.metric = metric
+        self.delta_e = delta_e_metrics[metric]
+        self.hash = palette_hash(palette, metric)
+        self.cache = cache
+        if cache is not None: cache.put_palette(self.hash, metric, self.entries)
+        self.memo = OrderedDict()
+        self.memo_size = memo_size
+        self.known = (np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32))
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, entry:str) -> Lab:
+        return self.palette[entry]
+
+    def find(self, colors:List[str]) -> List[str]:
+        """ Returns the closest palette entry to each of the given colors, without consulting the memo. """
+
+        if not colors: return []
+
+        distances = self.delta_e(hex_to_lab_array(colors), self.labs)
+        return [self.entries[i] for i in np.argmin(distances, axis=1)]
+
+    def match(self, color:str) -> str:
+        """ Returns the closest palette entry to the given 6-digit hexadecimal color. """
+        return self.match_many([color])[color]
+
+    def match_many(self, colors) -> Dict[str,str]:
+        """ Returns a dictionary mapping each of the given 6-digit hexadecimal colors to its closest palette entry. """
+
+        matches = {}; missing = []
+
+        with self.lock:
+            for color in colors:
+                match = self.memo.get(color)
+
+                if match is None:
+                    missing.append(color)
+                else:
+                    self.memo.move_to_end(color)
+                    matches[color] = match
+
+        if not missing: return matches
+
+        found = {}; unknown = []
+
+        for color in set(missing):
+            match = None if self.cache is None else self.cache.get_match(self.hash, color)
+
+            if match is None: unknown.append(color)
+            else: found[color] = match
+
+        for color, match in zip(unknown, self.find(unknown)):
+            found[color] = match
+            if self.cache is not None: self.cache.put_match(self.hash, color, match)
+
+        with self.lock:
+            for color, match in found.items():
+                self.memo[color] = match
+
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+
+        matches.update(found)
+        return matches
+
+    def match_array(self, rgb:np.ndarray) -> np.ndarray:
+        """ Returns a copy of the given array of rgb colors, with shape (..., 3), where each color is replaced by its closest palette entry. Colors are memoized for the lifetime of the matcher, so only colors never seen before are resolved. """
+
+        rgb = np.asarray(rgb, dtype=np.uint8)
+        keys, inverse = np.unique(pack_colors(rgb.reshape(-1, 3)), return_inverse=True)
+
+        # The memo is a single tuple of arrays, replaced rather than modified, so it can be read without the lock.
+        known_keys, known_values = self.known
+        values = np.zeros(len(keys), dtype=np.uint32)
+        seen = np.zeros(len(keys), dtype=bool)
+
+        if len(known_keys):
+            index = np.minimum(np.searchsorted(known_keys, keys), len(known_keys) - 1)
+            seen = known_keys[index] == keys
+            values[seen] = known_values[index[seen]]
+
+        if not seen.all():
+            unseen = keys[~seen]
+            colors = ["#%06x" % key for key in unseen.tolist()]
+            matches = self.match_many(colors)
+            values[~seen] = [int(matches[color][1:], 16) for color in colors]
+            self.remember(unseen, values[~seen])
+
+        return unpack_colors(values[inverse.reshape(-1)], 3).reshape(rgb.shape)
+
+    def remember(self, keys:np.ndarray, values:np.ndarray) -> None:
+        """ Adds packed rgb colors and their packed matches to the memo of match_array. """
+
+        with self.lock:
+            known_keys = np.concatenate((self.known[0], keys))
+            known_values = np.concatenate((self.known[1], values))
+
+            if len(known_keys) > self.memo_size:
+                known_keys, known_values = keys, values
+
+            order = np.argsort(known_keys, kind="stable")
+            self.known = (known_keys[order], known_values[order])
+
+# Match caching ----------------------------------------------------------------
+
+def match_fingerprint() -> str:
+    """ Returns a string identifying the current matching, i.e. the vectorized lab conversion and the closest matches under every metric, from a few reference colors. """
+
+    colors = ["#ffffff", "#000000", "#ff0000", "#00ff00", "#0000ff", "#808080", "#123456", "#fedcba"]
+    palette = ["#2e3440", "#88c0d0", "#bf616a", "#a3be8c", "#ebcb8b", "#eceff4"]
+    labs = hex_to_lab_array(colors)
+
+    matches = {
+        metric: np.argmin(delta_e(labs, hex_to_lab_array(palette)), axis=1).tolist()
+        for metric, delta_e in sorted(delta_e_metrics.items())
+    }
+
+    return json.dumps([np.round(labs, 6).tolist(), matches])
+
+def open_match_cache(path:str, max_entries:int=1_000_000) -> MatchCache:
+    """ Opens the persistent match cache at the given path for palette matchers. It is rebuilt if matching has changed since it was populated. """
+    return MatchCache(path, match_fingerprint(), PaletteMatcher, max_entries)
+
 # Pack management --------------------------------------------------------------
 
 def get_paths(folder: str, exts: List[str]) -> List[str]:
     """ Return paths of every file with the given extensions within a folder and its subfolders, excluding symbolic links. """
+    return list(iter_paths(folder, exts))
 
-    paths = []
+def iter_paths(folder:str, exts:List[str]):
+    """ Yields paths of every file with the given extensions within a folder and its subfolders, excluding symbolic links, while walking the folders. Works without recursion, so the depth of the folder structure is unbounded. """
 
-    for item in os.listdir(folder):
-        item_path = os.path.join(folder, item)
+    exts = tuple(exts)
+    folders = [folder]
 
-        if os.path.islink(item_path): # Link.
-            continue
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            subfolders = []
 
-        if os.path.isfile(item_path): # File.
-            for ext in exts:
-                if item.lower().endswith(ext):
-                    paths.append(item_path)
+            for entry in entries:
+                if entry.is_symlink(): # Link.
+                    continue
+
+                if entry.is_file(): # File.
+                    if entry.name.lower().endswith(exts):
+                        yield entry.path
+
+                elif entry.is_dir(): # Folder.
+                    subfolders.append(entry.path)
+
+        folders.extend(reversed(subfolders))
+
+def track(items, desc:str="files", unit:str="file", buffer:int=10000):
+    """ Yields from the given iterable while showing its progress. The iterable is consumed by a background thread, which refines the total as it goes, so that processing the first items overlaps with producing the rest. """
+
+    pending = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+    done = object()
+    state = {"found": 0, "error": None}
+
+    def put(item) -> bool:
+        """ Waits for room in the queue, unless the consumer stops first. Returns whether the item was queued. """
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                state["found"] += 1
+                if not put(item): return
+        except Exception as error:
+            state["error"] = error
+        finally:
+            put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    bar = tqdm(desc=desc, unit=unit)
+
+    try:
+        while True:
+            item = pending.get()
+            if item is done: break
 
-        elif os.path.isdir(item_path): # Folder.
-            subfolder_paths = get_paths(item_path, exts)
-            paths.extend(subfolder_paths)
+            if bar.total != state["found"]:
+                bar.total = state["found"]
+                bar.refresh()
 
-    return paths
+            yield item
+            bar.update(1)
+
+        if state["error"] is not None:
+            raise state["error"]
+    finally:
+        stop.set()
+        bar.close()
 
 def copy_file_structure(src_path:str, dest_path:str) -> None:
     """ Copies a directory tree, but changes symbolic links to point to files within the destination folder instead of the source. Assumes that no link points to files outside the source folder. """
@@ -323,16 +693,23 @@ def rename_pack(src_path, dest_path:str, name:str) -> None:
         with open(index_path, 'r') as file:
             text = file.read()
 
-        text = re.sub(r"(Name=).*", "\\1" + name, text, count=1)
-        text = re.sub(r"(GtkTheme=).*", "\\1" + name, text, count=1)
-        text = re.sub(r"(MetacityTheme=).*", "\\1" + name, text, count=1)
-        text = re.sub(r"(IconTheme=).*", "\\1" + name, text, count=1)
-
-        text = re.sub(r"(Comment=).*", "\\1" + "A variant of " + os.path.basename(src_path) + " created by nicklasvraa/color-manager", text, count=1)
+        text = rename_index(text, os.path.basename(src_path), name)
 
         with open(index_path, 'w') as file:
             file.write(text)
 
+def rename_index(text:str, src_name:str, name:str) -> str:
+    """ Returns the given index.theme string with appropiate naming applied. """
+
+    text = re.sub(r"(Name=).*", "\\1" + name, text, count=1)
+    text = re.sub(r"(GtkTheme=).*", "\\1" + name, text, count=1)
+    text = re.sub(r"(MetacityTheme=).*", "\\1" + name, text, count=1)
+    text = re.sub(r"(IconTheme=).*", "\\1" + name, text, count=1)
+
+    text = re.sub(r"(Comment=).*", "\\1" + "A variant of " + src_name + " created by nicklasvraa/color-manager", text, count=1)
+
+    return text
+
 def copy_pack(src_path:str, dest_path:str, name:str) -> str:
     """ Copy pack and return the resulting copy's directory path. """
 
@@ -349,31 +726,33 @@ def copy_pack(src_path:str, dest_path:str, name:str) -> str:
 def apply_monotones_to_vec(text:str, colors:Set[str], hsl:Tuple[float,float,float]) -> str:
     """ Replace every instance of color within the given list with their monochrome equivalent in the given string representing an svg-file, determined by the given hue, saturation and lightness offset. """
 
+    for color in colors:
+        text = text.replace(as_type(color, text), as_type(monotone(color, hsl), text))
+
+    return text
+
+def monotone(color:str, hsl:Tuple[float,float,float]) -> str:
+    """ Returns the monochrome equivalent of a 6-digit hexadecimal color, determined by the given hue, saturation and lightness offset. """
+
     h, s, l_offset = hsl
+    graytone = hex_to_gray(color)
 
     if s == 0:
-        for color in colors:
-            graytone = hex_to_gray(color)
-            text = re.sub(color, graytone, text)
-    else:
-        l_offset = (l_offset - 0.5) * 2 # Remapping.
+        return graytone
 
-        for color in colors:
-            graytone = hex_to_gray(color)
-            r, g, b = hex_to_rgb(graytone)
-            l = (0.21*r + 0.72*g + 0.07*b)/255
-            l = max(0, min(l+l_offset, 1))
-            monochrome = rgb_to_hex(hsl_to_rgb((h, s, l)))
-            text = re.sub(color, monochrome, text)
+    l_offset = (l_offset - 0.5) * 2 # Remapping.
+    r, g, b = hex_to_rgb(graytone)
+    l = (0.21*r + 0.72*g + 0.07*b)/255
+    l = max(0, min(l+l_offset, 1))
+    return rgb_to_hex(hsl_to_rgb((h, s, l)))
 
-    return text
-
-def apply_palette_to_vec(text:str, colors:Set[str], new_colors:Dict[str,Lab]) -> str:
+def apply_palette_to_vec(text:str, colors:Set[str], new_colors:"Union[PaletteMatcher,Dict[str,Lab]]") -> str:
     """ Replace hexadecimal color codes in a given svg/xml/css string with their closest matches within the given color palette. """
 
+    matches = as_matcher(new_colors).match_many(colors)
+
     for color in colors:
-        new_color = closest_match(color, new_colors)
-        text = re.sub(color, new_color, text)
+        text = text.replace(as_type(color, text), as_type(matches[color], text))
 
     return text
 
@@ -382,10 +761,48 @@ def apply_mapping_to_vec(text:str, colors:Set[str], map:Dict[str,str]) -> str:
 
     for color in colors:
         if color in map:
-            text = re.sub(color, map[color], text)
+            text = text.replace(as_type(color, text), as_type(map[color], text))
 
     return text
 
+def apply_to_vec(text:str, op:str, new_colors, css:bool=False) -> Optional[str]:
+    """ Preprocesses and recolors a given svg/xml/css string or bytes object, according to the operation returned by get_input_colors. Returns None if the text contains no colors, i.e. if nothing would change. """
+
+    # .svg files use similar color formats to css
+    text = css_to_hex(text)
+    text = expand_all_hex(text)
+    colors = get_file_colors(text)
+
+    if not colors:
+        return None
+
+    if op == "color":
+        text = apply_monotones_to_vec(text, colors, new_colors)
+    elif op == "palette":
+        text = apply_palette_to_vec(text, colors, new_colors)
+    elif op == "mapping":
+        text = apply_mapping_to_vec(text, colors, new_colors)
+
+    if css:
+        text = hex_to_css(text)
+
+    return text
+
+def recolor_vec_file(path:str, op:str, new_colors, css:bool=False, minify:bool=False) -> bool:
+    """ Recolors the given svg/xml/css file in place, working on its raw bytes. Files without colors are left untouched, unless they are to be minified. Returns whether the file was rewritten. """
+
+    with open_vec_file(path) as data:
+        x = apply_to_vec(data, op, new_colors, css)
+
+        if minify:
+            x = minify_svg(data if x is None else x)
+
+    if x is None:
+        return False
+
+    with open(path, 'wb') as file: file.write(x)
+    return True
+
 # Pixel-based recoloring -------------------------------------------------------
 
 def apply_monotones_to_img(img:Image, hsl:Tuple[float,float,float]) -> Image:
@@ -398,166 +815,898 @@ def apply_monotones_to_img(img:Image, hsl:Tuple[float,float,float]) -> Image:
         if mode == "RGBA": img = img.convert("LA")
         else: img = img.convert("L")
     else:
-        width, height = img.size
         l_offset = (l_offset - 0.5) * 2 # Remapping.
+        pixels = np.asarray(img)
+        r, g, b = (pixels[..., i].astype(np.float64) for i in range(3))
 
-        for x in range(width):
-            for y in range(height):
-                if mode == "RGBA":
-                    r, g, b, a = img.getpixel((x, y))
-                else:
-                    r, g, b = img.getpixel((x, y))
+        l = (0.21*r + 0.72*g + 0.07*b)/255
+        l = np.clip(l+l_offset, 0, 1)
 
-                l = (0.21*r + 0.72*g + 0.07*b)/255
-                l = max(0, min(l+l_offset, 1))
-                new_color = hsl_to_rgb((h, s, l))
+        # Same steps as hsl_to_rgb, for every pixel at once.
+        q = np.where(l < 0.5, l * (1 + s), l + s - l * s)
+        p = 2 * l - q
 
-                if mode == "RGBA":
-                    img.putpixel((x,y), new_color + (a,))
-                else:
-                    img.putpixel((x,y), new_color)
+        new_pixels = pixels.copy()
+        for i, t in enumerate((h + 1 / 3, h, h - 1 / 3)):
+            if t < 0: t += 1
+            if t > 1: t -= 1
+            if t < 1 / 6: channel = p + (q - p) * 6 * t
+            elif t < 1 / 2: channel = q
+            elif t < 2 / 3: channel = p + (q - p) * (2 / 3 - t) * 6
+            else: channel = p
+            new_pixels[..., i] = np.round(channel * 255)
+
+        img = Image.fromarray(new_pixels, mode)
 
     return img
 
-def apply_palette_to_img(img:Image, new_colors:Dict[str,Lab], smooth:bool) -> Image:
+def apply_palette_to_img(img:Image, new_colors:"Union[PaletteMatcher,Dict[str,Lab]]", smooth:bool) -> Image:
     """ Replace colors in a given image with the closest match within a given color palette. """
 
     if smooth: img = img.convert("P", palette=Image.ADAPTIVE, colors=256)
     else: img = img.convert("P")
 
-    palette = img.getpalette()
-
-    rgb_palette = [(palette[i], palette[i+1], palette[i+2]) for i in range(0, len(palette), 3)]
-
-    hex_palette = ["#%02x%02x%02x" % rgb for rgb in rgb_palette]
-
-    new_palette = []
-    for color in hex_palette:
-        new_color = hex_to_rgb(closest_match(color, new_colors))
-        new_palette.extend(new_color)
+    # Only the entries used by the image are resolved, the rest are kept as they are.
+    palette, used = get_used_palette(img)
+    palette[used] = as_matcher(new_colors).match_array(palette[used])
 
-    img.putpalette(new_palette)
+    img.putpalette(palette.tobytes())
     return img
 
 def apply_mapping_to_img(img:Image, map:Dict[str,str], smooth:bool) -> Image:
     """ Replace colors in a given image according to a given mapping. """
 
-    #raise Exception("Function not yet implemented.")
-
     if smooth: img = img.convert("P", palette=Image.ADAPTIVE, colors=256)
     else: img = img.convert("P")
 
-    palette = img.getpalette()
+    palette, used = get_used_palette(img)
 
-    rgb_palette = [(palette[i], palette[i+1], palette[i+2]) for i in range(0, len(palette), 3)]
+    for i, key in zip(used, pack_colors(palette[used]).tolist()):
+        color = map.get("#%06x" % key)
+        if color is not None: palette[i] = hex_to_rgb(color)
 
-    hex_palette = ["#%02x%02x%02x" % rgb for rgb in rgb_palette]
+    img.putpalette(palette.tobytes())
+    return img
 
-    new_palette = []
-    for color in hex_palette:
-        if color in map:
-            new_palette.extend(hex_to_rgb(map[color]))
-        else:
-            new_palette.extend(hex_to_rgb(color))
+def apply_to_img(img:Image, op:str, new_colors, smooth:bool, alpha:bool=True) -> Image:
+    """ Recolors a given image according to the operation returned by get_input_colors. If alpha is true, the image is returned as RGBA with its original alpha channel, otherwise as RGB. """
+
+    if alpha:
+        img = img.convert("RGBA")
+        a = img.split()[3] # Save original alpha channel.
+    else:
+        img = img.convert("RGB")
+
+    if op == "color":
+        img = apply_monotones_to_img(img, new_colors)
+    elif op == "palette":
+        img = apply_palette_to_img(img, new_colors, smooth)
+    elif op == "mapping":
+        img = apply_mapping_to_img(img, new_colors, smooth)
+
+    if alpha:
+        img = img.convert("RGBA")
+        r,g,b,_ = img.split()
+        img = Image.merge("RGBA",(r,g,b,a)) # Restore original alpha channel.
+    else:
+        img = img.convert("RGB")
 
-    img.putpalette(new_palette)
     return img
 
+def recolor_img_file(path:str, op:str, new_colors, smooth:bool, alpha:bool=True, encoding:Dict=None) -> None:
+    """ Recolors the given png/jpg file in place. """
+
+    src = Image.open(path)
+    x = apply_to_img(src, op, new_colors, smooth, alpha)
+    save_img(x, path, "png" if alpha else "jpg", encoding, src)
+
+def recolor_file(path:str, op:str, new_colors, smooth:bool, encoding:Dict=None) -> None:
+    """ Recolors the given file in place, in the way its extension calls for. Other files are left untouched. See get_encoding for the optional encoding policy. """
+
+    kind = get_kind(path)
+
+    if kind in ("vec", "css"):
+        minify = kind == "vec" and path.lower().endswith(".svg") and get_encoding(encoding)["svg_minify"]
+        recolor_vec_file(path, op, new_colors, css=(kind == "css"), minify=minify)
+    elif kind in ("png", "jpg"):
+        recolor_img_file(path, op, new_colors, smooth, alpha=(kind == "png"), encoding=encoding)
+    elif kind == "gresource":
+        recolor_gresource_file(path, op, new_colors, smooth, encoding)
+
+# Output encoding --------------------------------------------------------------
+
+def get_encoding(encoding:Dict=None) -> Dict:
+    """ Returns the given encoding policy, with every unspecified option taken from the default policy. The options are:
+    - png_palette: Save pngs with at most 256 unique colors as palette-based pngs, which is lossless.
+    - png_compress_level: From 0 to 9, where lower is faster, and higher is smaller.
+    - png_optimize: Search for the smallest png encoding, which is slow.
+    - jpg_keep_quality: Reuse the quantization tables and chroma subsampling of the source jpg.
+    - jpg_quality: Quality of jpgs, when not keeping the source's.
+    - svg_minify: Strip metadata, comments and whitespace between tags from svgs, where it does not affect rendering. """
+
+    if encoding is None: return default_encoding
+    return {**default_encoding, **encoding}
+
+def pack_colors(pixels:np.ndarray) -> np.ndarray:
+    """ Packs each row of an array of 8-bit channels, with shape (n, channels), into a single integer, e.g. to find unique colors in one pass. """
+
+    packed = np.zeros(len(pixels), dtype=np.uint32)
+    for channel in range(pixels.shape[1]):
+        packed = (packed << 8) | pixels[:, channel]
+
+    return packed
+
+def unpack_colors(packed:np.ndarray, channels:int) -> np.ndarray:
+    """ Inverse of pack_colors. """
+
+    colors = np.empty((len(packed), channels), dtype=np.uint8)
+    for channel in reversed(range(channels)):
+        colors[:, channel] = packed & 0xff
+        packed = packed >> 8
+
+    return colors
+
+def get_img_colors(img:Image) -> Tuple[np.ndarray,np.ndarray]:
+    """ Returns the unique colors of an RGB or RGBA image as an array with shape (n, 3) or (n, 4), as well as the index of each pixel's color within it. """
+
+    pixels = np.ascontiguousarray(np.asarray(img, dtype=np.uint8)).reshape(-1, len(img.mode))
+    keys, inverse = np.unique(pack_colors(pixels), return_inverse=True)
+
+    return unpack_colors(keys, pixels.shape[1]), inverse.reshape(-1)
+
+def get_used_palette(img:Image) -> Tuple[np.ndarray,np.ndarray]:
+    """ Returns the palette of a paletted image as an array with shape (n, 3), as well as the indices of the entries actually used by its pixels. """
+
+    palette = np.array(img.getpalette(), dtype=np.uint8).reshape(-1, 3)
+    used = np.flatnonzero(np.array(img.histogram()[:len(palette)]))
+
+    return palette, used
+
+def to_palette_img(img:Image) -> Image:
+    """ Returns the given RGB or RGBA image as a palette-based image with the exact same pixels, if it has at most 256 unique colors. Otherwise returns the image as is. """
+
+    if img.mode not in ("RGB", "RGBA") or img.getcolors(256) is None:
+        return img
+
+    colors, inverse = get_img_colors(img)
+    width, height = img.size
+
+    x = Image.fromarray(inverse.astype(np.uint8).reshape(height, width), "P")
+    x.putpalette(colors.tobytes(), rawmode=img.mode)
+    return x
+
+def save_img(img:Image, file, kind:str, encoding:Dict=None, source:Image=None) -> None:
+    """ Saves an image as either 'png' or 'jpg' to the given path or file object, according to the given encoding policy. Color profiles, and for jpgs also the quality settings, are taken from the source image, if given. """
+
+    encoding = get_encoding(encoding)
+    params = {}
+
+    if source is not None and "icc_profile" in source.info:
+        params["icc_profile"] = source.info["icc_profile"]
+
+    if kind == "png":
+        if encoding["png_palette"]: img = to_palette_img(img)
+
+        img.save(file, format="png", compress_level=encoding["png_compress_level"], optimize=encoding["png_optimize"], **params)
+
+    else:
+        if encoding["jpg_keep_quality"] and source is not None and source.format == "JPEG":
+            params["qtables"] = source.quantization
+            sampling = JpegImagePlugin.get_sampling(source)
+            if sampling != -1: params["subsampling"] = sampling
+            if "exif" in source.info: params["exif"] = source.info["exif"]
+        else:
+            params["quality"] = encoding["jpg_quality"]
+
+        img.save(file, format="jpeg", **params)
+
+# Archive handling -------------------------------------------------------------
+
+def is_archive(path:str) -> bool:
+    """ Returns true if the given path names a supported archive format. """
+    return path.lower().endswith(tuple(archive_modes))
+
+def archive_mode(path:str) -> str:
+    """ Returns the tarfile write mode matching the extension of the given path, or 'zip'. """
+
+    for ext in archive_modes:
+        if path.lower().endswith(ext):
+            return archive_modes[ext]
+
+    raise Exception("Unsupported archive: " + path)
+
+def get_kind(name:str) -> Optional[str]:
+    """ Returns which kind of recoloring applies to a file of the given name, if any. """
+
+    name = name.lower()
+
+    for kind, exts in file_kinds.items():
+        if name.endswith(tuple(exts)):
+            return kind
+
+    return None
+
+def clean_member(name:str) -> str:
+    """ Returns the given archive member name without leading slashes or './' prefixes. """
+
+    while name.startswith("./"): name = name[2:]
+    return name.lstrip("/")
+
+def is_inside(path:str, folder:str) -> bool:
+    """ Returns whether the given normalized path is the given folder or lies within it. """
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+def archive_root(names:List[str]) -> str:
+    """ Returns the single top-level folder shared by all given archive member names, including its trailing slash, or an empty string if there is none. """
+
+    names = [clean_member(name).rstrip("/") for name in names]
+    roots = {name.split("/", 1)[0] for name in names if name}
+    if len(roots) != 1: return ""
+
+    root = roots.pop() + "/"
+    if any(name.startswith(root) for name in names):
+        return root
+
+    return ""
+
+def iter_folder(src_path:str):
+    """ Yields (name, kind, data, mode) for every entry within a folder, where kind is either 'dir', 'file' or 'link'. Data is the file contents or the link target. Absolute links into the folder are made relative. """
+
+    for root, dirs, files in os.walk(src_path):
+        for item in sorted(dirs) + sorted(files):
+            path = os.path.join(root, item)
+            name = os.path.relpath(path, src_path).replace(os.sep, "/")
+            mode = stat.S_IMODE(os.lstat(path).st_mode)
+
+            if os.path.islink(path):
+                target = os.readlink(path)
+
+                if os.path.isabs(target) and target.startswith(src_path + os.sep):
+                    target = os.path.relpath(target, root)
+
+                yield name, "link", target, mode
+
+            elif os.path.isdir(path):
+                yield name, "dir", None, mode
+
+            else:
+                with open(path, 'rb') as file:
+                    yield name, "file", file.read(), mode
+
+def iter_archive(src_path:str):
+    """ Yields (name, kind, data, mode) for every member of a tar or zip archive, one member at a time, with the archive's top-level folder stripped. See iter_folder. """
+
+    if archive_mode(src_path) == "zip":
+        with zipfile.ZipFile(src_path) as archive:
+            root = archive_root(archive.namelist())
+
+            for info in archive.infolist():
+                name = clean_member(info.filename)[len(root):].rstrip("/")
+                mode = info.external_attr >> 16
+                if not name: continue
+
+                if info.is_dir():
+                    yield name, "dir", None, stat.S_IMODE(mode) or 0o755
+                elif stat.S_ISLNK(mode):
+                    yield name, "link", archive.read(info).decode(), stat.S_IMODE(mode)
+                else:
+                    yield name, "file", archive.read(info), stat.S_IMODE(mode) or 0o644
+    else:
+        with tarfile.open(src_path, "r:*") as archive:
+            root = archive_root(archive.getnames())
+
+            for member in archive:
+                name = clean_member(member.name)[len(root):].rstrip("/")
+                if not name: continue
+
+                if member.isdir():
+                    yield name, "dir", None, member.mode
+                elif member.issym():
+                    yield name, "link", member.linkname, member.mode
+                elif member.isfile() or member.islnk():
+                    yield name, "file", archive.extractfile(member).read(), member.mode
+
+def iter_pack(src_path:str):
+    """ Yields the entries of either a folder or an archive. See iter_folder. """
+
+    if is_archive(src_path):
+        return iter_archive(src_path)
+    else:
+        return iter_folder(src_path)
+
+@contextmanager
+def open_pack(dest_path:str, name:str):
+    """ Yields a function write(name, kind, data, mode), which adds an entry to a new pack of the given name. The pack is either written as an archive, if the destination path names one, or as a folder within the destination. See iter_folder. """
+
+    if not is_archive(dest_path):
+        dest_path = os.path.join(expand_path(dest_path), name)
+        shutil.rmtree(dest_path, ignore_errors=True)
+        os.makedirs(dest_path)
+
+        real_dest_path = os.path.realpath(dest_path)
+        links = []
+
+        def write(member, kind, data, mode):
+            path = os.path.normpath(os.path.join(dest_path, member))
+
+            if not is_inside(path, dest_path):
+                raise Exception("Invalid member: " + member)
+
+            # Links may only point within the pack, and are made last, see below.
+            if kind == "link":
+                target = os.path.normpath(os.path.join(os.path.dirname(path), data))
+
+                if os.path.isabs(data) or not is_inside(target, dest_path):
+                    raise Exception("Invalid link: " + member + " -> " + data)
+
+                links.append((path, data))
+                return
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            if not is_inside(os.path.realpath(path), real_dest_path):
+                raise Exception("Invalid member: " + member)
+
+            if kind == "dir":
+                os.makedirs(path, exist_ok=True)
+            else:
+                with open(path, 'wb') as file: file.write(data)
+                os.chmod(path, mode)
+
+        yield write
+
+        # Only once every file is written, so that none can be written through a link.
+        for path, target in links:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            if not is_inside(os.path.realpath(os.path.dirname(path)), real_dest_path):
+                raise Exception("Invalid member: " + os.path.relpath(path, dest_path))
+
+            os.symlink(target, path)
+
+        # Links through other links are only resolvable once all are made.
+        for path, target in links:
+            if not is_inside(os.path.realpath(path), real_dest_path):
+                os.remove(path)
+                raise Exception("Invalid link: " + os.path.relpath(path, dest_path) + " -> " + target)
+
+        return
+
+    dest_path = expand_path(dest_path)
+    now = time.time()
+    mode = archive_mode(dest_path)
+
+    if mode == "zip":
+        with zipfile.ZipFile(dest_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            def write(member, kind, data, mode):
+                info = zipfile.ZipInfo(name + "/" + member, time.localtime(now)[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+                if kind == "dir":
+                    info.filename += "/"
+                    info.external_attr = (stat.S_IFDIR | mode) << 16 | 0x10
+                    archive.writestr(info, b"")
+                elif kind == "link":
+                    info.external_attr = (stat.S_IFLNK | 0o777) << 16
+                    archive.writestr(info, data.encode())
+                else:
+                    info.external_attr = (stat.S_IFREG | mode) << 16
+                    archive.writestr(info, data)
+
+            yield write
+    else:
+        with tarfile.open(dest_path, mode) as archive:
+            def write(member, kind, data, mode):
+                info = tarfile.TarInfo(name + "/" + member)
+                info.mode = mode; info.mtime = now
+
+                if kind == "dir":
+                    info.type = tarfile.DIRTYPE
+                    archive.addfile(info)
+                elif kind == "link":
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = data
+                    archive.addfile(info)
+                else:
+                    info.size = len(data)
+                    archive.addfile(info, io.BytesIO(data))
+
+            yield write
+
+def transform_pack(src_path:str, dest_path:str, name:str, transform, desc:str="files") -> None:
+    """ Streams every entry of a source folder or archive into a new pack, one at a time, passing the contents of each file through the given transform(name, data) function. The transform returns the new contents, or None to keep the file as is. """
+
+    src_name = os.path.basename(src_path.rstrip(os.sep))
+
+    for ext in archive_modes:
+        if src_name.lower().endswith(ext):
+            src_name = src_name[:-len(ext)]
+
+    with open_pack(dest_path, name) as write:
+        for member, kind, data, mode in track(iter_pack(src_path), desc, buffer=64):
+            if kind == "file":
+                if member == "index.theme":
+                    text = data.decode("utf-8", "surrogateescape")
+                    data = rename_index(text, src_name, name).encode("utf-8", "surrogateescape")
+                else:
+                    x = transform(member, data)
+                    if x is not None: data = x
+
+            write(member, kind, data, mode)
+
+def recolor_bytes(name:str, data:bytes, op:str, new_colors, smooth:bool, encoding:Dict=None) -> Optional[bytes]:
+    """ Recolors the contents of a single file, given its name. Returns None if the file is not recolorable or would not change. See get_encoding for the optional encoding policy. """
+
+    kind = get_kind(name)
+
+    if kind == "vec":
+        x = apply_to_vec(data, op, new_colors)
+
+        if name.lower().endswith(".svg") and get_encoding(encoding)["svg_minify"]:
+            x = minify_svg(data if x is None else x)
+
+        return x
+
+    elif kind == "css":
+        return apply_to_vec(data, op, new_colors, css=True)
+
+    elif kind in ("png", "jpg"):
+        src = Image.open(io.BytesIO(data))
+        img = apply_to_img(src, op, new_colors, smooth, alpha=(kind == "png"))
+
+        output = io.BytesIO()
+        save_img(img, output, kind, encoding, src)
+        return output.getvalue()
+
+    elif kind == "gresource":
+        return recolor_gresource(data, op, new_colors, smooth, encoding)
+
+    return None
+
+# Resource bundles -------------------------------------------------------------
+
+def recolor_gresource(data:bytes, op:str, new_colors, smooth:bool, encoding:Dict=None) -> Optional[bytes]:
+    """ Recolors every recolorable file within the given gresource bundle, by its name, like recolor_bytes. Images that are not stored as such, e.g. those converted to pixdata, are kept as they are. Returns None if nothing would change. """
+
+    def transform(path, content):
+        try:
+            return recolor_bytes(path, content, op, new_colors, smooth, encoding)
+        except Image.UnidentifiedImageError:
+            return None
+
+    return transform_gresource(data, transform)
+
+def recolor_gresource_file(path:str, op:str, new_colors, smooth:bool, encoding:Dict=None) -> bool:
+    """ Recolors the given gresource bundle in place. Returns whether the file was rewritten. """
+
+    with open(path, 'rb') as file:
+        x = recolor_gresource(file.read(), op, new_colors, smooth, encoding)
+
+    if x is None:
+        return False
+
+    with open(path, 'wb') as file: file.write(x)
+    return True
+
+# Change detection -------------------------------------------------------------
+
+def update_file(src_path:str, dest_path:str, rel:str, op:str, new_colors, smooth:bool, name:str, encoding:Dict=None) -> None:
+    """ Brings a single entry of a pack generated by recolor up to date with its source, by copying and recoloring it again, or by deleting it, if it no longer exists. """
+
+    src = os.path.join(src_path, rel)
+    dest = os.path.join(dest_path, rel)
+
+    src_is_dir = os.path.isdir(src) and not os.path.islink(src)
+    dest_is_dir = os.path.isdir(dest) and not os.path.islink(dest)
+
+    if os.path.lexists(dest) and not (src_is_dir and dest_is_dir):
+        if dest_is_dir: shutil.rmtree(dest)
+        else: os.remove(dest)
+
+    if not os.path.lexists(src):
+        return
+
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+    if os.path.islink(src):
+        target = os.readlink(src)
+        if os.path.isabs(target) and target.startswith(src_path + os.sep):
+            target = os.path.relpath(target, os.path.dirname(src))
+        os.symlink(target, dest)
+
+    elif src_is_dir:
+        os.makedirs(dest, exist_ok=True)
+
+    elif rel == "index.theme":
+        shutil.copy2(src, dest)
+        rename_pack(src_path, dest_path, name)
+
+    else:
+        shutil.copy2(src, dest)
+        recolor_file(dest, op, new_colors, smooth, encoding)
+
+# Sharding ---------------------------------------------------------------------
+
+def parse_shard(shard:str) -> Tuple[int,int]:
+    """ Returns the index and count of a shard given as 'i/N', where i counts from 1. """
+
+    try:
+        i, n = (int(x) for x in shard.split("/"))
+    except ValueError:
+        raise Exception("Invalid shard: " + shard)
+
+    if not 1 <= i <= n:
+        raise Exception("Invalid shard: " + shard)
+
+    return i, n
+
+def in_shard(rel:str, i:int, n:int) -> bool:
+    """ Returns true if the file of the given relative path belongs to the i'th of n shards. The same path always belongs to the same shard, on any machine. """
+
+    digest = hashlib.md5(rel.replace(os.sep, "/").encode("utf-8", "surrogateescape")).digest()
+    return int.from_bytes(digest[:8], "big") % n == i - 1
+
+def shard_paths(dest_path:str, name:str, i:int, n:int) -> Tuple[str,str]:
+    """ Returns the staging folder and the manifest path of a shard. """
+
+    staging = os.path.join(expand_path(dest_path), name + ".shard-%d-of-%d" % (i, n))
+    return staging, staging + ".json"
+
+def job_hash(replacement, encoding:Dict=None) -> str:
+    """ Returns a hash identifying the output of a recoloring job, so that shards of different jobs are never merged. """
+
+    if isinstance(replacement, str): replacement = load_json_file(replacement)
+    return hashlib.sha1(json.dumps([replacement, get_encoding(encoding)], sort_keys=True).encode()).hexdigest()
+
+def recolor_shard(src_path:str, dest_path:str, name:str, replacement, shard:str, cache:"MatchCache"=None, encoding:Dict=None, report:"RunReport"=None) -> None:
+    """ Recolors one shard of a source folder into its staging folder, and writes its manifest. Used by the recolor function. """
+
+    check_path(src_path)
+    check_path(dest_path)
+
+    if is_archive(src_path) or is_archive(dest_path):
+        raise Exception("Sharding only supports folders.")
+
+    i, n = parse_shard(shard)
+    src_path = expand_path(src_path)
+    new_colors, smooth, op = get_input_colors(replacement, cache)
+
+    staging, manifest_path = shard_paths(dest_path, name, i, n)
+    shutil.rmtree(staging, ignore_errors=True)
+
+    files = {}
+    exts = [ext for kind in file_kinds for ext in file_kinds[kind]]
+
+    for path in track(iter_paths(src_path, exts), "shard %d/%d" % (i, n)):
+        rel = os.path.relpath(path, src_path)
+        if not in_shard(rel, i, n): continue
+
+        dest = os.path.join(staging, rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy2(path, dest)
+
+        with measure(report, rel, dest):
+            recolor_file(dest, op, new_colors, smooth, encoding)
+
+        with open(dest, 'rb') as file:
+            files[rel.replace(os.sep, "/")] = hashlib.sha256(file.read()).hexdigest()
+
+    manifest = {"shard": i, "shards": n, "job": job_hash(replacement, encoding), "files": files}
+
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=1)
+
+# Run reports ------------------------------------------------------------------
+
+class RunReport:
+    """ Records the duration, input and output size and memory use of each file of a run, to find the files that take most of the time or memory. Memory is measured as the growth of the peak resident set size of the process, and as the peak of memory traced by tracemalloc, which slows the run down, above its level before the file. """
+
+    def __init__(self, path:str=None, top:int=10, trace:bool=True):
+        self.path = path
+        self.top = top
+        self.files = []
+        self.start = time.perf_counter()
+
+        # Leave tracing alone if someone else started it.
+        self.trace = trace and not tracemalloc.is_tracing()
+        if self.trace: tracemalloc.start()
+
+    @contextmanager
+    def measure(self, name:str, bytes_in:int):
+        """ Measures the work done within the context, as that of the given file. The context yields the file's entry, whose "bytes_out" the caller should set, if there is any output. """
+
+        entry = {"file": name, "kind": get_kind(name) or "other", "bytes_in": bytes_in}
+        rss = peak_rss()
+
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            traced = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+
+        try:
+            yield entry
+        finally:
+            entry["seconds"] = time.perf_counter() - start
+            entry.setdefault("bytes_out", 0)
+            entry["rss_growth"] = peak_rss() - rss
+
+            if tracemalloc.is_tracing():
+                entry["traced_peak"] = tracemalloc.get_traced_memory()[1] - traced
+
+            self.files.append(entry)
+
+    def to_dict(self) -> Dict:
+        """ Returns the report as a json-serializable dictionary, with totals and throughput per kind of file, and the top files by duration, size and memory use. """
+
+        kinds = {}
+        for entry in self.files:
+            kind = kinds.setdefault(entry["kind"], {"files": 0, "seconds": 0.0, "bytes_in": 0, "bytes_out": 0})
+            kind["files"] += 1
+            for key in ("seconds", "bytes_in", "bytes_out"):
+                kind[key] += entry[key]
+
+        for kind in kinds.values():
+            kind["files_per_second"] = kind["files"] / kind["seconds"] if kind["seconds"] else None
+            kind["megabytes_per_second"] = kind["bytes_in"] / kind["seconds"] / 1e6 if kind["seconds"] else None
+
+        def top(key):
+            return sorted(self.files, key=lambda entry: entry.get(key, 0), reverse=True)[:self.top]
+
+        return {
+            "files": len(self.files),
+            "seconds": time.perf_counter() - self.start,
+            "peak_rss": peak_rss(),
+            "kinds": kinds,
+            "slowest": top("seconds"),
+            "largest": top("bytes_in"),
+            "most_memory": top("traced_peak" if self.trace else "rss_growth"),
+            "all": self.files
+        }
+
+    def summary(self, report:Dict=None) -> str:
+        """ Returns a human-readable summary of the report. """
+
+        if report is None: report = self.to_dict()
+
+        lines = ["%d files in %.2fs, peak rss %s" % (report["files"], report["seconds"], format_size(report["peak_rss"]))]
+
+        for kind, totals in sorted(report["kinds"].items()):
+            lines.append("  %-9s %6d files %9.2fs %10s in %10s out %8.1f files/s" % (
+                kind, totals["files"], totals["seconds"], format_size(totals["bytes_in"]),
+                format_size(totals["bytes_out"]), totals["files_per_second"] or 0))
+
+        for title, key, unit in (("Slowest", "slowest", "seconds"), ("Largest", "largest", "bytes_in"), ("Most memory", "most_memory", "traced_peak" if self.trace else "rss_growth")):
+            lines.append(title + ":")
+
+            for entry in report[key]:
+                value = "%.3fs" % entry[unit] if unit == "seconds" else format_size(entry.get(unit, 0))
+                lines.append("  %10s  %s" % (value, entry["file"]))
+
+        return "\n".join(lines)
+
+    def finish(self) -> Dict:
+        """ Stops tracing, prints the summary, saves the report as json if a path was given, and returns it. """
+
+        if self.trace: tracemalloc.stop()
+        report = self.to_dict()
+
+        print(self.summary(report))
+
+        if self.path is not None:
+            with open(expand_path(self.path), 'w') as file:
+                json.dump(report, file, indent=1)
+
+        return report
+
+@contextmanager
+def run_report(report):
+    """ Yields a run report if one is asked for, i.e. if report is True or the path to save it to, and otherwise None. The report is finished when the context exits, even if the run fails. """
+
+    if not report:
+        yield None
+        return
+
+    report = RunReport(report if isinstance(report, str) else None)
+
+    try:
+        yield report
+    finally:
+        report.finish()
+
+@contextmanager
+def measure(report:Optional[RunReport], name:str, src):
+    """ Measures the work done within the context in the given report, if any, as that of the named file. The source is either the file's contents, in which case the caller should set "bytes_out" of the entry yielded by the context, or the path of the file, whose size is taken before and, unless set by the caller, after. """
+
+    if report is None:
+        yield {}
+        return
+
+    in_memory = isinstance(src, bytes)
+
+    with report.measure(name, len(src) if in_memory else os.path.getsize(src)) as entry:
+        yield entry
+        if not in_memory: entry.setdefault("bytes_out", os.path.getsize(src))
+
+def peak_rss() -> int:
+    """ Returns the peak resident set size of the process in bytes, or 0 if unknown. """
+
+    if resource is None: return 0
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def format_size(size:int) -> str:
+    """ Returns a number of bytes in human-readable form, e.g. 1.5MB. """
+
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return ("%d%s" if unit == "B" else "%.1f%s") % (size, unit)
+        size /= 1024
+
 # User interface functions -----------------------------------------------------
 
-def recolor(src_path:str, dest_path:str, name:str, replacement) -> None:
-    """ Recursively copies and converts a source folder into a destination, given either an hsl color, a palette, or a color mapping. """
+def recolor(src_path:str, dest_path:str, name:str, replacement, cache:str=None, encoding:Dict=None, shard:str=None, report=None) -> None:
+    """ Recursively copies and converts a source folder into a destination, given either an hsl color, a palette, or a color mapping. Either path may also be a tar or zip archive, in which case files are streamed through the recoloring one at a time, without being extracted to disk. Optionally specify the path of a persistent match cache, to reuse color matches across runs, and an encoding policy for the output files, see get_encoding.
+
+    If a shard 'i/N' is given, only the i'th of N deterministic shares of the files are recolored, into a staging folder, to be assembled by merge_shards once all shards are done.
+
+    If report is true, or the path of a json file to save it to, the duration, size and memory use of each file is recorded and summarized at the end, see RunReport. """
+
+    if cache is not None:
+        cache = open_match_cache(cache)
+
+    try:
+        with run_report(report) as report:
+            if shard is None:
+                new_colors, smooth, op = get_input_colors(replacement, cache)
+                recolor_pack(src_path, dest_path, name, op, new_colors, smooth, encoding, report)
+            else:
+                recolor_shard(src_path, dest_path, name, replacement, shard, cache, encoding, report)
+    finally:
+        if cache is not None: cache.close()
+
+def recolor_pack(src_path:str, dest_path:str, name:str, op:str, new_colors, smooth:bool, encoding:Dict=None, report:RunReport=None) -> None:
+    """ Used by the recolor function. Takes the replacement as returned by get_input_colors, so that callers can keep using it. """
 
     check_path(src_path)
+
+    if is_archive(src_path) or is_archive(dest_path):
+        if is_archive(dest_path): check_path(os.path.dirname(expand_path(dest_path)))
+        else: check_path(dest_path)
+
+        def transform(member, data):
+            with measure(report, member, data) as entry:
+                x = recolor_bytes(member, data, op, new_colors, smooth, encoding)
+                entry["bytes_out"] = len(data if x is None else x)
+            return x
+
+        transform_pack(expand_path(src_path), dest_path, name, transform)
+        return
+
     check_path(dest_path)
+    dest_path = copy_pack(src_path, dest_path, name)
 
+    # Recolor files while still looking for more.
+    exts = [ext for kind in file_kinds for ext in file_kinds[kind]]
+    for path in track(iter_paths(dest_path, exts)):
+        with measure(report, os.path.relpath(path, dest_path), path):
+            recolor_file(path, op, new_colors, smooth, encoding)
+
+def watch(src_path:str, dest_path:str, name:str, replacement, interval:float=0.5, encoding:Dict=None) -> None:
+    """ Generates a pack like recolor, and then keeps watching the source folder, regenerating only the files that are changed, created, renamed or deleted, until interrupted. The palette and color conversions are kept in memory between changes. """
+
+    check_path(src_path)
+    check_path(dest_path)
+
+    if is_archive(src_path) or is_archive(dest_path):
+        raise Exception("Watching only supports folders.")
+
+    src_path = expand_path(src_path)
     new_colors, smooth, op = get_input_colors(replacement)
-    dest_path = copy_pack(src_path, dest_path, name)
+    recolor_pack(src_path, dest_path, name, op, new_colors, smooth, encoding)
+    dest_path = os.path.join(expand_path(dest_path), name)
 
-    # Recolor vector graphics.
-    paths = get_paths(dest_path, [".svg", ".xml"])
-    for path in tqdm(paths, desc="svg", disable=is_empty(paths)):
-        with open(path, 'r') as file: x = file.read()
+    print("Watching " + src_path + " for changes...")
 
-        # .svg files use similar color formats to css
-        x = css_to_hex(x)
-        x = expand_all_hex(x)
-        colors = get_file_colors(x)
+    try:
+        for changed in watch_changes(src_path, interval):
+            start = time.perf_counter()
 
-        if op == "color":
-            x = apply_monotones_to_vec(x, colors, new_colors)
-        elif op == "palette":
-            x = apply_palette_to_vec(x, colors, new_colors)
-        elif op == "mapping":
-            x = apply_mapping_to_vec(x, colors, new_colors)
+            # Parents before children, so new folders exist before their contents.
+            for rel in sorted(changed, key=lambda rel: rel.count(os.sep)):
+                try:
+                    update_file(src_path, dest_path, rel, op, new_colors, smooth, name, encoding)
+                except Exception as error:
+                    print("Failed to update " + rel + ": " + str(error))
 
-        with open(path, 'w') as file: file.write(x)
+            print("Updated %d file(s) in %.1fms" % (len(changed), (time.perf_counter() - start) * 1000))
 
-    # Recolor stylesheets.
-    paths = get_paths(dest_path, [".css", "rc"])
-    for path in tqdm(paths, desc="css", disable=is_empty(paths)):
-        with open(path, 'r') as file: x = file.read()
+    except KeyboardInterrupt:
+        pass
 
-        x = css_to_hex(x)
-        x = expand_all_hex(x)
-        colors = get_file_colors(x)
+def merge_shards(src_path:str, dest_path:str, name:str, shards:int) -> str:
+    """ Assembles the final pack from the staging folders and manifests of all shards of a sharded recolor, see recolor. The file structure, links and index.theme are taken from the source, like with recolor. Fails if any shard is missing, is from a different job, or if any file is not covered by a shard. Returns the path of the pack. """
 
-        if op == "color":
-            x = apply_monotones_to_vec(x, colors, new_colors)
-        elif op == "palette":
-            x = apply_palette_to_vec(x, colors, new_colors)
-        elif op == "mapping":
-            x = apply_mapping_to_vec(x, colors, new_colors)
+    check_path(src_path)
+    check_path(dest_path)
 
-        x = hex_to_css(x)
-        with open(path, 'w') as file: file.write(x)
+    src_path = expand_path(src_path)
+    manifests = []
 
-    # Recolor pngs.
-    paths = get_paths(dest_path, [".png"])
-    for path in tqdm(paths, desc="png", disable=is_empty(paths)):
-        x = Image.open(path)
-        x = x.convert("RGBA")
-        a = x.split()[3] # Save original alpha channel.
+    for i in range(1, shards + 1):
+        staging, manifest_path = shard_paths(dest_path, name, i, shards)
 
-        if op == "color":
-            x = apply_monotones_to_img(x, new_colors)
-        elif op == "palette":
-            x = apply_palette_to_img(x, new_colors, smooth)
-        elif op == "mapping":
-            x = apply_mapping_to_img(x, new_colors, smooth)
+        if not os.path.exists(manifest_path):
+            raise Exception("Missing shard %d/%d: %s" % (i, shards, manifest_path))
 
-        x = x.convert("RGBA")
-        r,g,b,_ = x.split()
-        x = Image.merge("RGBA",(r,g,b,a)) # Restore original alpha channel.
-        x.save(path)
+        manifest = load_json_file(manifest_path)
 
-    # Recolor jpgs.
-    paths = get_paths(dest_path, [".jpg", ".jpeg"])
-    for path in tqdm(paths, desc="jpg", disable=is_empty(paths)):
-        x = Image.open(path)
-        x = x.convert("RGB")
+        if manifest.get("shard") != i or manifest.get("shards") != shards:
+            raise Exception("Manifest %s is for shard %s/%s, not %d/%d." % (manifest_path, manifest.get("shard"), manifest.get("shards"), i, shards))
 
-        if op == "color":
-            x = apply_monotones_to_img(x, new_colors)
-        elif op == "palette":
-            x = apply_palette_to_img(x, new_colors, smooth)
-        elif op == "mapping":
-            x = apply_mapping_to_img(x, new_colors, smooth)
+        manifests.append((staging, manifest))
+
+    if len({manifest["job"] for _, manifest in manifests}) != 1:
+        raise Exception("Shards belong to different recoloring jobs.")
+
+    # Every recolorable source file must be covered by exactly its own shard.
+    exts = [ext for kind in file_kinds for ext in file_kinds[kind]]
+    expected = {os.path.relpath(path, src_path).replace(os.sep, "/") for path in iter_paths(src_path, exts)}
+    covered = set()
+    for _, manifest in manifests: covered |= manifest["files"].keys()
+
+    if expected != covered:
+        missing = sorted(expected - covered)[:5]
+        raise Exception("Shards do not cover the source, e.g.: " + ", ".join(missing or sorted(covered - expected)[:5]))
+
+    pack_path = copy_pack(src_path, dest_path, name)
+
+    for staging, manifest in manifests:
+        for rel, digest in manifest["files"].items():
+            staged = os.path.join(staging, rel)
+
+            with open(staged, 'rb') as file:
+                if hashlib.sha256(file.read()).hexdigest() != digest:
+                    raise Exception("Corrupt shard file: " + staged)
+
+            os.replace(staged, os.path.join(pack_path, rel))
+
+    for staging, _ in manifests:
+        shutil.rmtree(staging)
+        os.remove(staging + ".json")
 
-        x = x.convert("RGB")
-        x.save(path)
+    return pack_path
 
-def extract_colors(src_path:str, num_colors:int=8, save_path:str=None, pixels:int=50, cols:int=10) -> List[str]:
-    """ Returns and optionally saves the color palette of the given image, as its own image. Optionally specify the number of unique colors you want to be found. """
+def recolor_sharded(src_path:str, dest_path:str, name:str, replacement, shards:int, encoding:Dict=None) -> None:
+    """ Runs a sharded recolor with one local process per shard, standing in for separate machines, and merges the result. See recolor. """
+
+    with multiprocessing.Pool(shards) as pool:
+        pool.starmap(recolor, [
+            (src_path, dest_path, name, replacement, None, encoding, "%d/%d" % (i, shards))
+            for i in range(1, shards + 1)
+        ])
+
+    merge_shards(src_path, dest_path, name, shards)
+
+def extract_colors(src_path:str, num_colors:int=8, save_path:str=None, pixels:int=50, cols:int=10, report=None) -> List[str]:
+    """ Returns and optionally saves the color palette of the given image, as its own image. Optionally specify the number of unique colors you want to be found, and ask for a run report like with recolor. """
 
     check_path(src_path)
+    with run_report(report) as report, measure(report, src_path, src_path) as entry:
+        colors = extract_file_colors(src_path, num_colors, save_path, pixels, cols)
+        entry["bytes_out"] = os.path.getsize(save_path) if save_path is not None else 0
+
+    return colors
+
+def extract_file_colors(src_path:str, num_colors:int, save_path:str, pixels:int, cols:int) -> List[str]:
+    """ Used by the extract_colors function. """
+
     _, ext = os.path.splitext(src_path)
 
     if ext == ".svg":
-        with open(src_path, 'r') as file:
-            svg = file.read()
-
-        colors = list(get_file_colors(svg))
+        with open_vec_file(src_path) as svg:
+            colors = list(get_file_colors(svg))
         num_colors = len(colors)
 
     else:
@@ -573,76 +1722,284 @@ def extract_colors(src_path:str, num_colors:int=8, save_path:str=None, pixels:in
 
         if num_colors < cols: cols = num_colors
 
-        rows = -(-len(colors) // cols)
-        width = cols * pixels; height = rows * pixels
+        img = draw_swatches(colors, pixels, cols)
+        img.save(save_path, format="png")
 
-        img = Image.new("RGBA", (width, height))
-        draw = ImageDraw.Draw(img)
+    return colors
 
-        for i, hex_color in enumerate(colors):
-            row = i // cols; col = i % cols
-            x0 = col * pixels; y0 = row * pixels
-            x1 = x0 + pixels; y1 = y0 + pixels
-            draw.rectangle([x0, y0, x1, y1], fill=hex_color)
+def draw_swatches(colors:List[str], pixels:int=50, cols:int=10) -> Image:
+    """ Returns an image of the given colors as a grid of square swatches. """
 
-        img.save(save_path, format="png")
+    cols = max(1, cols)
+    rows = -(-len(colors) // cols)
+    width = cols * pixels; height = rows * pixels
 
-    return colors
+    img = Image.new("RGBA", (width, height))
+    draw = ImageDraw.Draw(img)
+
+    for i, hex_color in enumerate(colors):
+        row = i // cols; col = i % cols
+        x0 = col * pixels; y0 = row * pixels
+        x1 = x0 + pixels; y1 = y0 + pixels
+        draw.rectangle([x0, y0, x1, y1], fill=hex_color)
+
+    return img
+
+def get_preview_sample(src_path:str, icons:int=16, size:int=48, wallpaper_width:int=320, limit:int=2000) -> Dict:
+    """ Returns a representative sample of a pack for the preview function, loaded into memory: evenly spread, downscaled png icons, the colors of the svg/css files, and a downscaled wallpaper, i.e. the first image at least 512 pixels on each side. At most limit files are looked at. """
+
+    check_path(src_path)
+    src_path = expand_path(src_path)
+
+    exts = [ext for kind in file_kinds for ext in file_kinds[kind]]
+    paths = []
+    for path in iter_paths(src_path, exts):
+        paths.append(path)
+        if len(paths) >= limit: break
+
+    sample = {"icons": [], "colors": set(), "wallpaper": None}
+    pngs = []
+
+    for path in paths:
+        kind = get_kind(path)
+
+        if kind in ("vec", "css"):
+            with open_vec_file(path) as x:
+                sample["colors"] |= get_file_colors(expand_all_hex(css_to_hex(x)))
+
+        elif kind in ("png", "jpg"):
+            img = Image.open(path)
+
+            if min(img.size) >= 512:
+                if sample["wallpaper"] is None:
+                    img.thumbnail((wallpaper_width, wallpaper_width))
+                    sample["wallpaper"] = img.convert("RGB")
+            elif kind == "png":
+                pngs.append(path)
+
+    # Spread the icons evenly across the pack.
+    step = max(1, len(pngs) / icons)
+    for i in range(min(icons, len(pngs))):
+        img = Image.open(pngs[int(i * step)]).convert("RGBA")
+        img.thumbnail((size, size))
+        sample["icons"].append(img)
+
+    sample["colors"] = sorted(sample["colors"], key=lambda color: hex_to_hsl(color))
+    sample["size"] = size
+    return sample
+
+def preview(src, replacement, save_path:str=None, max_colors:int=48) -> Image:
+    """ Returns and optionally saves a contact sheet, showing what a given hsl color, palette or mapping would do to a pack, without recoloring the pack itself. The source is either a path to a pack, or a sample returned by get_preview_sample, which can be reused for faster previews. """
+
+    sample = src if isinstance(src, dict) else get_preview_sample(src)
+    new_colors, smooth, op = get_input_colors(replacement)
+    size = sample["size"]; gap = size // 4
+    sections = []
+
+    # Recolored icons.
+    if sample["icons"]:
+        icons = [apply_to_img(icon, op, new_colors, smooth) for icon in sample["icons"]]
+        cols = min(len(icons), 8)
+        sheet = Image.new("RGBA", (cols * (size + gap) - gap, -(-len(icons) // cols) * (size + gap) - gap))
+
+        for i, icon in enumerate(icons):
+            x = (i % cols) * (size + gap) + (size - icon.width) // 2
+            y = (i // cols) * (size + gap) + (size - icon.height) // 2
+            sheet.paste(icon, (x, y), icon)
+
+        sections.append(sheet)
+
+    # Colors of vector graphics and stylesheets, before and after.
+    colors = sample["colors"][:max_colors]
+    if colors:
+        if op == "color":
+            new = [monotone(color, new_colors) for color in colors]
+        elif op == "palette":
+            matches = as_matcher(new_colors).match_many(colors)
+            new = [matches[color] for color in colors]
+        else:
+            new = [new_colors.get(color, color) for color in colors]
+
+        pixels = size // 2
+        cols = min(len(colors), 16)
+        before = draw_swatches(colors, pixels, cols)
+        after = draw_swatches(new, pixels, cols)
+
+        sheet = Image.new("RGBA", (before.width, 2 * before.height + gap // 2))
+        sheet.paste(before, (0, 0)); sheet.paste(after, (0, before.height + gap // 2))
+        sections.append(sheet)
+
+    # Recolored wallpaper.
+    if sample["wallpaper"] is not None:
+        sections.append(apply_to_img(sample["wallpaper"], op, new_colors, smooth, alpha=False).convert("RGBA"))
+
+    width = max([section.width for section in sections], default=1)
+    height = max(1, sum(section.height + gap for section in sections) - gap)
+    img = Image.new("RGBA", (width, height))
+
+    y = 0
+    for section in sections:
+        img.paste(section, ((width - section.width) // 2, y))
+        y += section.height + gap
+
+    if save_path is not None:
+        img.save(expand_path(save_path), format="png")
+
+    return img
 
 def clean_svg(src_path:str, dest_path:str=None) -> str:
     """ Removes needless metadata from svgs and optionally saves as copy, if output path is specified. """
 
     check_path(src_path)
-    with open(src_path, 'r') as f:
+    with open(src_path, 'rb') as f:
         svg = f.read()
 
-    patterns = [
-        r".*xmlns:.*\n",
-        r"\s*<metadata[\s\S]*?<\/metadata.*",
-        r"\s*<sodipodi[\s\S]*?<\/sodipodi.*",
-    ]
-
-    for pattern in patterns:
-        svg = re.sub(pattern, '', svg)
+    svg = pick(svg_namespace_pattern, svg).sub(b'', svg)
+    svg = strip_svg_metadata(svg)
 
     if dest_path is None: dest_path = src_path
     else: check_path(dest_path)
 
-    with open(dest_path, 'w') as f:
+    with open(dest_path, 'wb') as f:
         f.write(svg)
 
-def add_backdrop(src_path:str, dest_path:str, name:str, color:str="#000000", padding=0, rounding=0):
-    """ Add a customizable backdrop to all svg-based icons. Optionally specify the backdrop color, the padding to the edge of the graphic, and the corner rounding factor. """
+def strip_svg_metadata(svg:str) -> str:
+    """ Returns the given svg string or bytes object without metadata and sodipodi elements. """
+
+    for pattern in svg_metadata_patterns:
+        svg = pick(pattern, svg).sub(as_type('', svg), svg)
+
+    return svg
+
+def minify_svg(svg:str) -> str:
+    """ Returns the given svg string or bytes object without metadata, comments, indentation and whitespace between tags, so that it renders the same. Whitespace within text elements and xml:space="preserve" subtrees, and the contents of style and script elements, are kept as they are. Unlike clean_svg, namespace declarations are kept, as attributes like xlink:href depend on them. """
+
+    text = svg if isinstance(svg, str) else svg.decode("utf-8", "surrogateescape")
+    output = []
+    stack = [] # The name and mode of every open element, where the mode is 'skip', 'raw', 'preserve' or None.
+
+    for token in svg_token_pattern.findall(text):
+        mode = stack[-1][1] if stack else None
+        name = svg_tag_name_pattern.match(token)
+        name = name.group(1) if name else None
+        is_end = token.startswith("</")
+        is_open = name is not None and not is_end and not token.endswith("/>")
+
+        if mode == "raw":
+            if is_end and name == stack[-1][0]: stack.pop()
+            output.append(token)
+
+        elif mode == "skip":
+            if is_open: stack.append((name, "skip"))
+            elif is_end: stack.pop()
+
+        elif token.startswith("<!--"):
+            continue
+
+        elif name is None:
+            if mode == "preserve" or token.startswith("<") or not token.isspace():
+                output.append(token)
+
+        elif is_end:
+            if stack: stack.pop()
+            output.append(token)
+
+        else:
+            local = name.rpartition(":")[2]
+
+            if local == "metadata" or name.startswith("sodipodi:"):
+                mode = "skip"
+            elif local in ("style", "script"):
+                mode = "raw"
+            elif local in ("text", "tspan", "textPath", "foreignObject"):
+                mode = "preserve"
+
+            space = svg_space_pattern.search(token)
+            if space and mode != "skip":
+                mode = "preserve" if space.group(1) == "preserve" else None
+
+            if mode != "skip": output.append(token)
+            if is_open: stack.append((name, mode))
+
+    text = "".join(output).strip()
+    return text if isinstance(svg, str) else text.encode("utf-8", "surrogateescape")
+
+def add_backdrop_to_vec(svg:str, color:str="#000000", padding=0, rounding=0) -> str:
+    """ Returns the given svg string with a backdrop inserted behind its graphic. See add_backdrop. """
+
+    width = int(re.search(r'<svg.*width=\"(\d*)\"', svg).group(1))
+    height = int(re.search(r'<svg.*height=\"(\d*)\"', svg).group(1))
+    pos = re.search(r'<svg.*>\n', svg).end()
+
+    backdrop = '<rect fill="' + color + '" x="' + str(padding) + '" y="' + str(padding) + '" width="' + str(width-2*padding) + '" height="' + str(height-2*padding) + '" rx="' + str(rounding * (width / 2)) + '" ry="' + str(rounding * (height / 2)) + '"/>'
+
+    credit = "\n<!-- Inserted by Color Manager -->\n"
+    return svg[:pos] + credit + backdrop + credit + svg[pos:]
+
+def add_backdrop(src_path:str, dest_path:str, name:str, color:str="#000000", padding=0, rounding=0, report=None):
+    """ Add a customizable backdrop to all svg-based icons. Optionally specify the backdrop color, the padding to the edge of the graphic, and the corner rounding factor. Either path may also be a tar or zip archive, and a run report may be asked for, like with recolor. """
 
     check_path(src_path)
-    check_path(dest_path)
-    dest_path = copy_pack(src_path, dest_path, name)
-    svg_paths = get_paths(dest_path, [".svg"])
 
-    for path in tqdm(svg_paths, desc="Changing svgs  ", unit="file"):
-        with open(path, 'r') as file:
-            svg = file.read()
+    with run_report(report) as report:
+        if is_archive(src_path) or is_archive(dest_path):
+            if is_archive(dest_path): check_path(os.path.dirname(expand_path(dest_path)))
+            else: check_path(dest_path)
+
+            def transform(member, data):
+                if not member.lower().endswith(".svg"): return None
+
+                with measure(report, member, data) as entry:
+                    svg = data.decode("utf-8", "surrogateescape")
+                    svg = add_backdrop_to_vec(svg, color, padding, rounding)
+                    x = svg.encode("utf-8", "surrogateescape")
+                    entry["bytes_out"] = len(x)
 
-        width = int(re.search(r'<svg.*width=\"(\d*)\"', svg).group(1))
-        height = int(re.search(r'<svg.*height=\"(\d*)\"', svg).group(1))
-        pos = re.search(r'<svg.*>\n', svg).end()
+                return x
 
-        backdrop = '<rect fill="' + color + '" x="' + str(padding) + '" y="' + str(padding) + '" width="' + str(width-2*padding) + '" height="' + str(height-2*padding) + '" rx="' + str(rounding * (width / 2)) + '" ry="' + str(rounding * (height / 2)) + '"/>'
+            transform_pack(expand_path(src_path), dest_path, name, transform, "Changing svgs  ")
+            return
 
-        credit = "\n<!-- Inserted by Color Manager -->\n"
-        svg = svg[:pos] + credit + backdrop + credit + svg[pos:]
+        check_path(dest_path)
+        dest_path = copy_pack(src_path, dest_path, name)
 
-        with open(path, 'w') as file:
-            file.write(svg)
+        for path in track(iter_paths(dest_path, [".svg"]), "Changing svgs  "):
+            with measure(report, os.path.relpath(path, dest_path), path):
+                with open(path, 'rb') as file:
+                    svg = file.read().decode("utf-8", "surrogateescape")
+
+                svg = add_backdrop_to_vec(svg, color, padding, rounding)
+
+                with open(path, 'wb') as file:
+                    file.write(svg.encode("utf-8", "surrogateescape"))
 
 # Global constants -------------------------------------------------------------
 
-# A dynamic dictionary to avoid multiple color conversions.
+# A dynamic dictionary to avoid multiple color conversions in closest_match.
 hex_to_lab_dict = {
-    "#ffffff": LabColor(9341.568974319263, -0.037058350415009045, -0.6906417562959177), # White.
+    "#ffffff": rgb_to_lab(sRGBColor(255,255,255)), # White.
     "#000000": LabColor(0,0,0) # Black.
 }
 
+# Constants of the rgb to lab conversion used by basic_colormath.
+rgb_to_xyz_matrix = np.array([
+    [0.412424, 0.357579, 0.180464],
+    [0.212656, 0.715158, 0.0721856],
+    [0.0193324, 0.119193, 0.950444]
+])
+xyz_illuminant = np.array([0.95047, 1.0, 1.08883])
+
+# Color difference metrics selectable by the 'metric' key of a palette.
+delta_e_metrics = {
+    "cie76": delta_e_cie76,
+    "cie94": delta_e_cie94,
+    "ciede2000": delta_e_ciede2000
+}
+
+# The dictionary is cleared when it grows beyond this many entries.
+max_lab_entries = 1 << 16
+
+
 # A static dictionary of named colors from the css standard.
 name_to_hex_dict = load_json_file(
     os.path.join(
@@ -650,3 +2007,59 @@ name_to_hex_dict = load_json_file(
         "named_colors.json"
     )
 )
+
+# File extensions handled by each kind of recoloring.
+file_kinds = {
+    "vec": [".svg", ".xml"],
+    "css": [".css", "rc"],
+    "png": [".png"],
+    "jpg": [".jpg", ".jpeg"],
+    "gresource": [".gresource"]
+}
+
+# Supported archive extensions and their tarfile write modes.
+archive_modes = {
+    ".tar.gz": "w:gz", ".tgz": "w:gz",
+    ".tar.xz": "w:xz", ".txz": "w:xz",
+    ".tar.bz2": "w:bz2", ".tbz2": "w:bz2",
+    ".tar": "w", ".zip": "zip"
+}
+
+# The encoding policy used for output files, unless another is given. See get_encoding.
+default_encoding = {
+    "png_palette": True,
+    "png_compress_level": 6,
+    "png_optimize": False,
+    "jpg_keep_quality": True,
+    "jpg_quality": 75,
+    "svg_minify": False
+}
+
+# Files at least this many bytes large are read through a memory map.
+mmap_threshold = 1 << 16
+
+# Precompiled patterns, each as a (str, bytes) pair. See compile_both.
+css_rgba_pattern = compile_both(r"rgba\((\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*([\d.]+)\)")
+css_rgb_pattern = compile_both(r"rgb\((\d+)\s*,\s*(\d+)\s*,\s*(\d+)\)")
+hex3_pattern = compile_both(r"((?<!&)#[A-Fa-f0-9]{3})\b")
+hex6_pattern = compile_both(r"#[A-Fa-f0-9]{6}")
+hex8_pattern = compile_both(r"(#[0-9a-fA-F]{8})")
+
+svg_namespace_pattern = compile_both(r".*xmlns:.*\n")
+svg_metadata_patterns = [
+    compile_both(r"\s*<metadata[\s\S]*?<\/metadata.*"),
+    compile_both(r"\s*<sodipodi[\s\S]*?<\/sodipodi.*")
+]
+
+# Patterns splitting an svg into comments, cdata sections, processing instructions, doctypes, tags and text. See minify_svg.
+svg_token_pattern = re.compile(r"""<!--[\s\S]*?-->|<!\[CDATA\[[\s\S]*?\]\]>|<\?[\s\S]*?\?>|<!(?:[^\[>]|\[[\s\S]*?\])*>|<(?:[^>"']|"[^"]*"|'[^']*')*>|[^<]+|<""")
+svg_tag_name_pattern = re.compile(r"</?([^\s/>!?]+)")
+svg_space_pattern = re.compile(r"""\sxml:space\s*=\s*["'](\w+)["']""")
+
+named_color_patterns = [
+    (compile_both(name + r"\b"), (hex, hex.encode()))
+    for name, hex in name_to_hex_dict.items()
+]
+any_named_color_pattern = compile_both(
+    "(?:" + "|".join(name_to_hex_dict) + r")\b"
+)
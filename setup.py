@@ -23,6 +23,7 @@ setup(
     install_requires=[
         "basic_colormath",
         "tqdm",
-        "pillow"
+        "pillow",
+        "numpy"
     ],
 )